@@ -0,0 +1,95 @@
+import hashlib
+import json
+from datetime import datetime
+from math import trunc
+
+import polyinterface
+
+from rm_functions import rmfuncs as rm
+
+LOGGER = polyinterface.LOGGER
+
+
+class RmDailyStats(polyinterface.Node):
+    id = "dailystat"
+
+    def __init__(self, controller, primary, address, name, url, token):
+        self.url = url
+        self.token = token
+        self.cache_day = None  # calendar day the cached stats were fetched on
+        self.cache_key = None  # fingerprint of the restrictions and mixer data the stats were computed from
+        self.stats = {}
+        super(RmDailyStats, self).__init__(controller, primary, address, name)
+
+    def is_current(self, restrictions=None, mixer_data=None):
+        """ True if the cached stats were fetched today from the same restrictions and mixer data """
+        return self.cache_day == datetime.now().strftime("%Y-%m-%d") and \
+            self.cache_key == self.invalidation_key(restrictions, mixer_data)
+
+    def set_Driver(self, restrictions=None, mixer_data=None):
+        today = datetime.now().strftime("%Y-%m-%d")
+        key = self.invalidation_key(restrictions, mixer_data)
+
+        if self.is_current(restrictions, mixer_data):
+            LOGGER.debug("Daily stats cache is current for {}".format(today))
+            return
+
+        try:
+            stats = rm.RmApiGet(self.url, self.token, 'api/4/dailystats')
+            details = rm.RmApiGet(self.url, self.token, 'api/4/dailystats/details')
+            LOGGER.debug("Daily stats: {}, details: {}".format(stats, details))
+
+            projected = {}
+            for day in stats['DailyStats']:
+                # The device reports the watering percentage as a fraction of the scheduled time
+                projected[day['day']] = {'percentage': round(day['percentage'] * 100), 'runtime': 0}
+
+            for day in details['DailyStatsDetails']:
+                runtime = 0
+                for program in day['programs']:
+                    for zone in program['zones']:
+                        runtime += zone['computedWateringTime']
+                projected.setdefault(day['day'], {'percentage': 0})['runtime'] = runtime
+
+        except (KeyError, TypeError) as err:
+            LOGGER.error("Couldn't update daily watering stats: {}".format(err))
+            return
+
+        self.stats = projected
+        self.cache_day = today
+        self.cache_key = key
+
+        days = sorted(d for d in projected if d >= today)[:3]
+        days += [None] * (3 - len(days))
+        for driver, day in zip(('ST', 'GV0', 'GV1'), days):
+            self.setDriver(driver, projected[day]['percentage'] if day else 0)
+        for driver, day in zip(('GV2', 'GV3', 'GV4'), days):
+            self.setDriver(driver, trunc(projected[day]['runtime'] / 60) if day else 0)
+
+    @staticmethod
+    def invalidation_key(restrictions, mixer_data):
+        """ Fingerprint the inputs that change the projected watering, ignoring running counters """
+        relevant = {}
+        if restrictions:
+            relevant['restrictions'] = {k: restrictions.get(k) for k in
+                                        ('hourly', 'freeze', 'month', 'weekDay', 'rainDelay', 'rainSensor')}
+        if mixer_data:
+            relevant['mixer'] = [(d.get('day'), d.get('rain'), d.get('qpf'), d.get('et0final'))
+                                 for d in mixer_data.get('mixerDataByDate', [])]
+        return hashlib.sha1(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+
+    def query(self):
+        self.reportDrivers()
+
+    drivers = [
+        {'driver': 'ST', 'value': 0, 'uom': 51},  # Projected watering percentage today
+        {'driver': 'GV0', 'value': 0, 'uom': 51},  # Projected watering percentage tomorrow
+        {'driver': 'GV1', 'value': 0, 'uom': 51},  # Projected watering percentage day after tomorrow
+        {'driver': 'GV2', 'value': 0, 'uom': 45},  # Projected runtime today
+        {'driver': 'GV3', 'value': 0, 'uom': 45},  # Projected runtime tomorrow
+        {'driver': 'GV4', 'value': 0, 'uom': 45}  # Projected runtime day after tomorrow
+    ]
+
+    commands = {
+        'QUERY': query
+    }
@@ -1,8 +1,11 @@
 from datetime import datetime
 
+import numpy as np
 import polyinterface
 
 from rm_functions import rmfuncs as rm
+from rm_functions import weather
+from rm_functions.weather import MixerWindow
 
 LOGGER = polyinterface.LOGGER
 
@@ -15,58 +18,71 @@ class RmPrecip( polyinterface.Node ):
         self.token = token
         self.hwver = hwver
         self.units = units
+        self.mixer_data = None  # today and the next 2 days from the window, shared with the daily stats node
+        self.window = MixerWindow()  # 30 days back, 7 forward, see rm_functions/weather.py
         super( RmPrecip, self ).__init__( controller, primary, address, name )
 
     def set_Driver (self):
-        # Now fill in precip forecast and fields
+        # Bring the mixer window up to date, past days are kept so only today onwards is fetched
 
         try:
-            precip = ["", "", "", ""]
+            today = datetime.now().date()
+            start, days = self.window.fetch_range( today )
 
-            # now = datetime.now()
-            today = datetime.now().strftime( "%Y-%m-%d" )
-
-            mixer_data = rm.RmApiGet( self.url, self.token, 'api/4/mixer/' + today + '/3' )
+            mixer_data = rm.RmApiGet( self.url, self.token,
+                                      'api/4/mixer/' + start.strftime( "%Y-%m-%d" ) + '/' + str( days ) )
             LOGGER.debug( "Mixer data: {}".format( mixer_data ) )
 
-            precip[0] = mixer_data['mixerDataByDate'][0]['rain']
-            precip[1] = mixer_data['mixerDataByDate'][0]['qpf']
-            precip[2] = mixer_data['mixerDataByDate'][1]['qpf']
-            precip[3] = mixer_data['mixerDataByDate'][2]['qpf']
+            if not isinstance( mixer_data, dict ):
+                LOGGER.error( "Couldn't update precipation data or forecast" )
+                return None
+            self.window.merge( mixer_data, today )
+
+        except:
+            LOGGER.error( "Couldn't update precipation data or forecast" )
+            return None
+
+        self.mixer_data = self.window.as_mixer_data( today, 3 )
+        self.render()
+        return self.mixer_data
+
+    def render (self):
+        # Fill in the drivers from the mixer window, no device call so a units change is cheap
+        mixer_data = self.mixer_data
+        if mixer_data is None:
+            return
+
+        try:
+            by_date = mixer_data['mixerDataByDate']
+            precip = [by_date[0]['rain'], by_date[0]['qpf'], by_date[1]['qpf'], by_date[2]['qpf']]
             LOGGER.debug( "Precip list: {}".format( precip ) )
-            for i in range( 0, 3 ):
-                if precip[i] == None:
-                    precip[i] = 0
-            # LOGGER.debug("Precip list2: {}".format(precip))
-
-            rain = float( precip[0] )
-            qpf1 = float( precip[1] )
-            qpf2 = float( precip[2] )
-            qpf3 = float( precip[3] )
-            units_uom = '82'
-
-            if self.units != 'metric':
-                rain = round( (rain / 25.4), 2 )
-                qpf1 = round( (qpf1 / 25.4), 2 )
-                qpf2 = round( (qpf2 / 25.4), 2 )
-                qpf3 = round( (qpf3 / 25.4), 2 )
-                units_uom = '105'
-            self.setDriver( 'ST', rain, uom=units_uom )
-            self.setDriver( 'GV0', qpf1, uom=units_uom )
-            self.setDriver( 'GV1', qpf2, uom=units_uom )
-            self.setDriver( 'GV2', qpf3, uom=units_uom )
+
+            stats = self.window.analytics()
+            LOGGER.debug( "Mixer window analytics: {}".format( stats ) )
+
+            values, units_uom = weather.convert( precip + [stats['rain7'], stats['rain30'], stats['deficit7']],
+                                                 self.units )
+            values[np.isnan( values )] = 0
+            for driver, value in zip( ('ST', 'GV0', 'GV1', 'GV2', 'GV3', 'GV4', 'GV5'), values ):
+                self.setDriver( driver, float( value ), uom=units_uom )
+            self.setDriver( 'GV6', round( stats['skip'] ) )
 
         except:
             LOGGER.error( "Couldn't update precipation data or forecast" )
 
     def query (self):
         self.reportDrivers()
+        self.controller.refresh_stale( 'api/4/mixer' )
 
     drivers = [
         {'driver': 'ST', 'value': 0, 'uom': 82},  # Rain today
         {'driver': 'GV0', 'value': 0, 'uom': 82},  # Precip forecast for today added in V 0.2.6
         {'driver': 'GV1', 'value': 0, 'uom': 82},  # Precip forecast for tomorrow
-        {'driver': 'GV2', 'value': 0, 'uom': 82}  # Precip forecast for day after tomorrow
+        {'driver': 'GV2', 'value': 0, 'uom': 82},  # Precip forecast for day after tomorrow
+        {'driver': 'GV3', 'value': 0, 'uom': 82},  # Rain in the last 7 days
+        {'driver': 'GV4', 'value': 0, 'uom': 82},  # Rain in the last 30 days
+        {'driver': 'GV5', 'value': 0, 'uom': 82},  # ET deficit over the last 7 days (ET0 less rain)
+        {'driver': 'GV6', 'value': 0, 'uom': 51}  # Likelihood the next 3 days are skipped for rain
     ]
 
     commands = {
@@ -1,8 +1,13 @@
 from datetime import datetime
+from math import trunc
 
 import polyinterface
 
+from rm_functions import budget
 from rm_functions import rmfuncs as rm
+from rm_functions import volume
+from rm_functions.history import StateHistory
+from rm_functions.schedule import ProgramSchedule
 
 LOGGER = polyinterface.LOGGER
 
@@ -12,6 +17,10 @@ class RmProgram(polyinterface.Node):
     def __init__(self, controller, primary, address, name, url, token):
         self.url = url
         self.token = token
+        self.history = StateHistory()
+        self.schedule = ProgramSchedule()
+        self.run_volume = 0.0  # litres, current or last run
+        self.running = False
         #self.program_data = rm.RmApiGet(url, token, 'api/4/program')
         super(RmProgram, self).__init__(controller, primary, address, name)
 
@@ -46,20 +55,55 @@ class RmProgram(polyinterface.Node):
         else:
             LOGGER.error("Invalid driver called in RmProgram")
 
+    def update_history(self, status):
+        self.history.append(status)
+        self.setDriver('GV4', trunc(self.history.runtime() / 60))
+
+        since = self.history.time_since_last_run()
+        if since is None:
+            self.setDriver('GV5', -1)  # Not seen running since the nodeserver started
+        else:
+            self.setDriver('GV5', trunc(since / 60))
+
+    def update_volume(self, status, litres, units):
+        """ Credit the water its own zones used since the last program update to this program while it runs """
+        running = status == 1
+        if running and not self.running:
+            self.run_volume = 0.0  # a new run is starting
+        if running:
+            self.run_volume += litres
+        self.running = running
+        value, uom = volume.for_units(self.run_volume, units)
+        self.setDriver('GV8', value, uom=uom)
+
+    def update_schedule(self, program, location, hourly_restrictions):
+        if self.schedule.update(program, location, hourly_restrictions):
+            LOGGER.debug("{} timeline: {}".format(self.name, self.schedule.timeline))
+            self.setDriver('GV7', trunc(self.schedule.duration / 60))
+        self.setDriver('GV6', self.schedule.minutes_until_next_run())
+
     def program_run(self, command):
         LOGGER.debug(command)
-        rm.RmProgramCtrl(self.url, self.token, command)
+        self.controller.loop.submit(rm.RmProgramCtrl, self.url, self.token, command,
+                                    priority=budget.COMMAND)
 
     def program_stop(self, command):
         LOGGER.debug(command)
-        rm.RmProgramCtrl(self.url, self.token, command)
+        self.controller.loop.submit(rm.RmProgramCtrl, self.url, self.token, command,
+                                    priority=budget.COMMAND)
 
     def query(self):
         self.reportDrivers()
+        self.controller.refresh_stale('api/4/program')
 
     drivers = [
         {'driver': 'ST', 'value': 0, 'uom': 25},  # Program status -
-        {'driver': 'GV3', 'value': 0, 'uom': 25}  # Program nextrun
+        {'driver': 'GV3', 'value': 0, 'uom': 25},  # Program nextrun
+        {'driver': 'GV4', 'value': 0, 'uom': 45},  # Program runtime in the last 24 hours
+        {'driver': 'GV5', 'value': -1, 'uom': 45},  # Minutes since the program last ran
+        {'driver': 'GV6', 'value': -1, 'uom': 45},  # Minutes until the next run
+        {'driver': 'GV7', 'value': 0, 'uom': 45},  # Expected run duration
+        {'driver': 'GV8', 'value': 0, 'uom': 35},  # Estimated water used, current or last run
         #    {'driver': 'GV4', 'value': '0', 'uom': '58'}, #
     ]
 
@@ -1,5 +1,6 @@
 import polyinterface
 LOGGER = polyinterface.LOGGER
+from rm_functions import budget
 from rm_functions import rmfuncs as rm
 from math import trunc
 
@@ -10,6 +11,7 @@ class RmRestrictions(polyinterface.Node):
         self.url = url
         self.token = token
         self.hwver = hwver
+        self.restrictions = None  # last restrictions response, shared with the daily stats node
         super(RmRestrictions, self).__init__(controller, primary, address, name)
 
     def set_Driver(self):
@@ -40,14 +42,19 @@ class RmRestrictions(polyinterface.Node):
                 # Set these drivers to N/A for hardware version 1 RMs, not supported
         except:
             LOGGER.error("Unable to update Restrictions data")
+            return None
+
+        self.restrictions = restrictions
+        return restrictions
 
     def query(self):
         self.reportDrivers()
+        self.controller.refresh_stale('api/4/restrictions/currently')
 
     def set_rain_delay(self, command):
         LOGGER.debug("Received command {} in 'set_rain_delay'".format(command))
-        st = rm.RmSetRainDelay(self.url, self.token, command)
-        return st
+        return self.controller.loop.submit(rm.RmSetRainDelay, self.url, self.token, command,
+                                           priority=budget.COMMAND)
 
     drivers = [
         {'driver': 'ST', 'value': 0, 'uom': 25},  # Rain Sensor
@@ -1,8 +1,13 @@
+import threading
+import time
 from math import trunc
 
 import polyinterface
 
+from rm_functions import budget
 from rm_functions import rmfuncs as rm
+from rm_functions import volume
+from rm_functions.history import MAX_SAMPLE_GAP, RUNNING, StateHistory
 
 LOGGER = polyinterface.LOGGER
 
@@ -12,18 +17,28 @@ class RmZone(polyinterface.Node):
     def __init__(self, controller, primary, address, name, url, token):
         self.url = url
         self.token = token
+        self.history = StateHistory()
+        self.countdown = None  # (monotonic time, remaining seconds) from the last poll while running
+        self.countdown_lock = threading.Lock()  # the countdown ticks on its own thread, polls and commands on the I/O loop
+        self.flow_rate = 0.0  # litres per minute, from the zone properties at discovery
+        self.volume_sample = None  # (time, state) at the last volume update
+        self.run_volume = 0.0  # litres, current or last run
+        self.total_volume = 0.0  # litres since the nodeserver started
 
         super(RmZone, self).__init__(controller, primary, address, name)
 
     def set_Driver(self, driver, value,):
         if driver == 'ST':
             self.setDriver(driver , value)
+            if value != RUNNING:
+                self.stop_countdown()
             #LOGGER.debug( "in zone setDriver: {} {} {}".format(self, driver, value ) )
         elif driver == 'GV3':
-            self.setDriver(driver, trunc(value/60))
-            #LOGGER.debug( "in zone setDriver: {} {} {}".format(self, driver, trunc(value / 60 ) ))
+            with self.countdown_lock:
+                self.setDriver(driver, trunc(value/60))
+                #LOGGER.debug( "in zone setDriver: {} {} {}".format(self, driver, trunc(value / 60 ) ))
 
-            self.setDriver('GV4', value % 60)
+                self.setDriver('GV4', value % 60)
             #LOGGER.debug( "in zone setDriver: {} {} {}".format(self, 'GV4', value % 60 ) )
         elif driver == 'GV5':
             if value == 'master':
@@ -35,22 +50,96 @@ class RmZone(polyinterface.Node):
 
         else:
             LOGGER.error("Invalid driver called in RmProgram")
+
+    def update_history(self, state, remaining):
+        self.history.append(state, remaining)
+        self.setDriver('GV6', trunc(self.history.runtime() / 60))
+
+        since = self.history.time_since_last_run()
+        if since is None:
+            self.setDriver('GV7', -1)  # Not seen running since the nodeserver started
+        else:
+            self.setDriver('GV7', trunc(since / 60))
+
+    def update_volume(self, state, units):
+        """ Add the water used since the last poll from the cached flow rate, returns the litres added """
+        now = time.time()
+        added = 0.0
+        if self.volume_sample is None or self.volume_sample[1] != RUNNING:
+            if state == RUNNING:
+                self.run_volume = 0.0  # a new run is starting
+        else:
+            added = self.flow_rate * min(now - self.volume_sample[0], MAX_SAMPLE_GAP) / 60
+        self.volume_sample = (now, state)
+
+        self.run_volume += added
+        self.total_volume += added
+        value, uom = volume.for_units(self.run_volume, units)
+        self.setDriver('GV8', value, uom=uom)
+        value, uom = volume.for_units(self.total_volume, units)
+        self.setDriver('GV9', value, uom=uom)
+        return added
+
+    def anchor_countdown(self, state, remaining):
+        """ Restart the local countdown from a polled remaining time, the polled value always wins """
+        if state != RUNNING or not remaining:
+            self.stop_countdown()
+            return
+
+        now = time.monotonic()
+        with self.countdown_lock:
+            if self.countdown is not None:
+                drift = self.countdown_remaining(now) - remaining
+                if abs(drift) >= 2:
+                    LOGGER.debug("{} countdown was off by {:.1f}s, corrected from poll".format(self.name, drift))
+            self.countdown = (now, remaining)
+
+    def countdown_remaining(self, now=None):
+        countdown = self.countdown
+        if countdown is None:
+            return 0
+        if now is None:
+            now = time.monotonic()
+        anchored_at, remaining = countdown
+        return max(0.0, remaining - (now - anchored_at))
+
+    def countdown_tick(self):
+        """ Step GV3/GV4 between polls """
+        with self.countdown_lock:
+            if self.countdown is None:
+                return
+            left = self.countdown_remaining()
+            self.setDriver('GV3', trunc(left / 60))
+            self.setDriver('GV4', trunc(left % 60))
+            if left <= 0:
+                self.countdown = None  # wait for the next poll to say what happens next
+
+    def stop_countdown(self):
+        with self.countdown_lock:
+            self.countdown = None
+
     def zone_run(self, command):
         LOGGER.debug(command)
-        rm.RmZoneCtrl(self.url, self.token, command)
+        self.controller.loop.submit(rm.RmZoneCtrl, self.url, self.token, command, priority=budget.COMMAND)
 
     def zone_stop(self, command):
         LOGGER.debug(command)
-        rm.RmZoneCtrl(self.url, self.token, command)
+        self.controller.loop.submit(rm.RmZoneCtrl, self.url, self.token, command, priority=budget.COMMAND)
+        self.stop_countdown()
 
     def query(self):
         self.reportDrivers()
+        self.controller.refresh_stale('api/4/zone')
 
     drivers = [
         {'driver': 'ST', 'value': 0, 'uom': 25},  # Zone state
         {'driver': 'GV3', 'value': 0, 'uom': 45},  # Zone runtime minutes remaining
         {'driver': 'GV4', 'value': 0, 'uom': 58},  # Zone runtime seconds remaining
         {'driver': 'GV5', 'value': 0, 'uom': 2},  # Is this a master zone?
+        {'driver': 'GV6', 'value': 0, 'uom': 45},  # Zone runtime in the last 24 hours
+        {'driver': 'GV7', 'value': -1, 'uom': 45},  # Minutes since the zone last ran
+        {'driver': 'GV8', 'value': 0, 'uom': 35},  # Estimated water used, current or last run
+        {'driver': 'GV9', 'value': 0, 'uom': 35},  # Estimated water used since the nodeserver started
     ]
 
     commands = {
@@ -1,4 +1,5 @@
 """ Node classes for the Rainmachine nodeserver"""
+from .RmDailyStats import RmDailyStats
 from .RmPrecip import RmPrecip
 from .RmProgram import RmProgram
 from .RmRestrictions import RmRestrictions
@@ -15,8 +15,16 @@ import urllib3
 # from nodes import RmPrecip
 # from nodes import RmProgram
 from nodes import *
+from rm_functions import budget
 from rm_functions import rmfuncs as rm
 from rm_functions import utils
+from rm_functions import volume
+from rm_functions.cache import StateCache
+from rm_functions.eventloop import EventLoop
+from rm_functions.pollsched import PollGuard, Ticker
+from rm_functions.profiler import PollProfiler
+from rm_functions.proxy import CachingProxy
+from rm_functions.tiers import TIERS, TierSchedule, intervals_from_params
 
 urllib3.disable_warnings()
 """
@@ -32,6 +40,11 @@ logs/debug.log
 You can use LOGGER.info, LOGGER.warning, LOGGER.debug, LOGGER.error levels as needed.
 """
 
+MAX_ADDS_IN_FLIGHT = 5  # node adds sent to Polyglot before waiting for replies during discovery
+ADD_NODE_TIMEOUT = 30  # seconds to wait on Polyglot before carrying on anyway
+CONFIG_NOTICES = ('config_hostname', 'config_password', 'config_units')
+MAX_POLL_DEFER = 60  # seconds a poll cycle waits for the request budget before leaving the rest for the next cycle
+
 
 class RMController(polyinterface.Controller):
 
@@ -64,7 +77,26 @@ class RMController(polyinterface.Controller):
         self.rmprognode = []
         self.rmprecipnode = None
         self.rmrestrictnode = None
+        self.rmdailynode = None
+        self.location = None  # api/4/provision location, for sunrise/sunset program starts
+        self.hourly_restrictions = []
+        self.total_volume = 0.0  # litres used by all zones since the nodeserver started
+        self.zone_volume = {}  # zone uid -> litres used since the last program update, credited to the programs watering it
         self.winter_mode = False
+        self.loop = EventLoop()  # owns all device I/O and node state, see rm_functions/eventloop.py
+        self.params = None  # (Hostname, Password, Units) as last applied, diffed against new configs
+        self.cache = StateCache()  # last data fetched per endpoint, with its fetch time
+        self.profiler = PollProfiler()  # armed by the PROFILE command
+        self.tiers = TierSchedule()  # per-endpoint poll intervals, see rm_functions/tiers.py
+        self.poller = EventLoop('rainmachine-poll')  # sequences poll cycles, the fetches themselves run on self.loop
+        self.poll = PollGuard('poll', self.poller.submit, self.profiler.wrap(self._poll_cycle), self.poll_overrun)
+        self.countdown = Ticker('rainmachine-countdown', 1, self.countdown_tick)  # zone time remaining between polls
+        self.query_max_age = 60  # seconds before a query triggers a refresh
+        self.request_limits = (budget.DEFAULT_RATE, budget.DEFAULT_BURST)
+        self.proxy_bind = '127.0.0.1'
+        self.proxy_port = None  # local caching proxy for other systems, off unless ProxyPort is set
+        self.proxy = CachingProxy(self.cache, self.max_age, self.proxy_passthrough, self.refresh_stale)
+        self.proxy_running = None  # (bind, port) the proxy is listening on
 
         self.loglevel = {
             0: 'None',
@@ -75,6 +107,8 @@ class RMController(polyinterface.Controller):
             50: 'Critical'
         }
 
+        self.poly.onConfig(self.process_config)
+
     def start(self):
         """
         Optional.
@@ -87,12 +121,15 @@ class RMController(polyinterface.Controller):
         # This grabs the server.json data and checks profile_version is up to date
 
         LOGGER.info('Started Rainmachine NodeServer')
+        self.loop.start()
+        self.poller.start()
+        self.countdown.start()
         # serverdata = utils.get_server_data(LOGGER)
         # LOGGER.debug("Server data: {}".format(serverdata))
         utils.update_version(LOGGER)
         utils.profile_zip(LOGGER)
         self.poly.installprofile()
-        self.check_params()
+        self.loop.call(self.check_params)
         self.removeNoticesAll()
         #if not self.winter_mode:
         #    self.discover()
@@ -100,42 +137,102 @@ class RMController(polyinterface.Controller):
 
 
     def shortPoll(self):
+        """ Each shortPoll fetches whichever endpoints are due, so shortPoll should be the shortest tier interval """
+        self.poll.tick()
+
+    def longPoll(self):
+        # Everything longPoll used to fetch now has its own tier, checked on every shortPoll
+        pass
+
+    def countdown_tick(self):
+        # On the ticker thread, not the I/O loop, so the count keeps going while a fetch or node add is blocked
+        for node in self.rmzonenode:
+            node.countdown_tick()
+
+    def poll_overrun(self, guard, persisting):
+        key = 'overrun_' + guard.name
+        if persisting:
+            self.addNotice("RainMachine {} cycles are taking longer than the poll interval ({:.0f}s last cycle, "
+                           "{} overruns). Check the network or increase the poll interval.".format(
+                               guard.name, guard.last_duration, guard.overruns), key)
+        else:
+            LOGGER.info("{} is keeping up with its interval again".format(guard.name))
+            self.removeNotice(key)
 
+    def _poll_cycle(self):
+        """
+        Fetch each endpoint whose polling tier is due.
+        Runs on the poll thread and queues each fetch as its own I/O loop task, so a command from
+        ISY waits for at most one fetch instead of the whole cycle.
+        """
         if self.winter_mode:
             return
         if not self.discovery_done:
-            self.discover()
+            self.loop.call(self._discover, priority=budget.DISCOVERY)
+            if not self.discovery_done:
+                return
 
-        LOGGER.debug("In shortPoll, access token: {}".format(self.access_token))
-        if self.access_token is None:
-            return
+        now = time.monotonic()  # tiers are timed from the cycle start, not from when each fetch finished
+        due = self.tiers.due(now)
+        LOGGER.debug("Poll cycle, due: {}".format(due))
 
-        # Get the latest from the zones
-        self.getZoneUpdate()
-
-        # Update program status
-        self.getProgramUpdate()
-
-    def longPoll(self):
-
-        """ We check the heartbeat, get updates for precipitation and restrictions nodes """
-        if not self.discovery_done or self.winter_mode:
-            return
-
-        self.rm_pulse()  # Is the RM on the network
+        if 'heartbeat' in due:
+            self._poll_step(self.rm_pulse)  # Is the RM on the network
+            self.tiers.done('heartbeat', now)
 
         if self.access_token is None:
             LOGGER.error('Bad password or hostname')
             return
 
-        LOGGER.debug("In longPoll, access token: {}".format(self.access_token))
-
-        # Check for precipitation and forecast changes
-        if self.hwver is not 1:
-            self.getPrecipNodeUpdate()
+        for endpoint in due:
+            if endpoint == 'heartbeat':
+                continue
+            if not self._wait_for_budget():
+                return
+            self._poll_step(self.poll_endpoint, endpoint, now)
+
+        if 'api/4/restrictions/currently' in due:
+            # Location and hourly restriction windows for the program timelines, picked up on the next program poll
+            if self._wait_for_budget(2):
+                self._poll_step(self.getScheduleInputs)
+
+        if 'api/4/mixer' in due or 'api/4/restrictions/currently' in due:
+            # Projected watering, only refetched on a new day or when restrictions or the mixer change
+            if not self.dailyStatsCurrent() and self._wait_for_budget(2):
+                self._poll_step(self.getDailyStatsUpdate)
+
+    def _wait_for_budget(self, tokens=1):
+        """ Defer the next fetch on the poll thread until the request budget has tokens, rather than have it dropped """
+        deadline = time.monotonic() + MAX_POLL_DEFER
+        while True:
+            wait = rm.BUDGET.wait_time(tokens)
+            if wait <= 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                LOGGER.warning("Request budget still empty after {}s, leaving the rest of the poll for the next cycle"
+                               .format(MAX_POLL_DEFER))
+                return False
+            LOGGER.debug("Request budget empty, deferring poll {:.1f}s".format(wait))
+            time.sleep(wait)
+
+    def _poll_step(self, fn, *args):
+        """ Run one part of a poll cycle as its own I/O loop task and wait for it """
+        return self.loop.call(self.profiler.step(fn), *args)
+
+    def poll_endpoint(self, endpoint, now=None):
+        updates = {
+            'api/4/zone': self.getZoneUpdate,
+            'api/4/program': self.getProgramUpdate,
+            'api/4/restrictions/currently': self.getRestrictionsUpdate,
+        }
+        if self.hwver != 1:
+            # Hardware version 1 has no mixer data
+            updates['api/4/mixer'] = self.getPrecipNodeUpdate
 
-        # Update status of restrictions
-        self.getRestrictionsUpdate()
+        # A failed or dropped fetch leaves the endpoint due, so the next cycle tries it again
+        update = updates.get(endpoint)
+        if update is None or update():
+            self.tiers.done(endpoint, now)
 
     def query(self, command=None):
         """
@@ -143,12 +240,33 @@ class RMController(polyinterface.Controller):
         By default a query to the control node reports the FULL driver set for ALL
         nodes back to ISY. If you override this method you will need to Super or
         issue a reportDrivers() to each node manually.
+        Answers straight away from the last polled values, then refreshes anything older than its max_age.
         """
-        self.check_params()
         for node in self.nodes:
             self.nodes[node].reportDrivers()
+        self.refresh_stale('api/4/zone', 'api/4/program', 'api/4/mixer', 'api/4/restrictions/currently')
+
+    def max_age(self, endpoint):
+        """ Seconds before cached data is stale: the endpoint's poll interval, or QueryMaxAge if that is longer """
+        return max(self.query_max_age, self.tiers.intervals.get(endpoint, 0))
+
+    def refresh_stale(self, *endpoints):
+        """ Refresh the endpoints whose cached data is older than their max_age, sharing any refresh already running """
+        if not self.discovery_done or self.winter_mode:
+            return
+        for endpoint in endpoints:
+            if endpoint == 'api/4/mixer' and self.hwver == 1:
+                continue
+            if not self.cache.is_stale(endpoint, self.max_age(endpoint)):
+                continue
+            LOGGER.debug("Cached {} is stale, refreshing".format(endpoint))
+            self.cache.refresh(endpoint, lambda endpoint=endpoint: self.loop.submit(self.poll_endpoint, endpoint))
 
     def discover(self, *args, **kwargs):
+        return self.loop.submit(self._discover, priority=budget.DISCOVERY)
+
+    @budget.priority(budget.DISCOVERY)
+    def _discover(self):
         if self.host == "":
             LOGGER.error("Hostname or IP missing")
             return
@@ -179,7 +297,7 @@ class RMController(polyinterface.Controller):
         if self.access_token is None:
             return
 
-        # Collect the zone information from the Rainmachine
+        # Collect the zone and program information from the Rainmachine
         zone_data = rm.RmApiGet(self.top_level_url, self.access_token, 'api/4/zone')
 
         if zone_data is None:
@@ -187,6 +305,15 @@ class RMController(polyinterface.Controller):
                                                                                                   self.access_token))
             return
 
+        program_data = rm.RmApiGet(self.top_level_url, self.access_token, 'api/4/program')
+        LOGGER.debug("Program data: {}".format(program_data))
+        if program_data is None:
+            LOGGER.error('Can\'t get Rainmachine programs (url {0:s}, access_token {1:s}'.format(self.top_level_url,
+                                                                                                 self.access_token))
+            return
+
+        # Build the full node set first, then register it with Polyglot in one batch
+        zones = []
         for z in zone_data['zones']:
             z_name = z['name'].replace('&', 'and')  # substitute 'and' for '&' in zone names
             zone_name = z_name.translate(self.translation_table)  # remove illegal characters from zone name
@@ -195,43 +322,110 @@ class RMController(polyinterface.Controller):
             if z['master']:
                 zone_name = "Master Zone"
 
-            self.rmzonenode.append(self.addNode(
-                # RmZone(self, self.address, 'zone' + str(z['uid']), 'Zone ' + str(z['uid']) + " - " + z['name']))
-                RmZone(self, self.address, 'zone' + str(z['uid']), 'Zone ' + str(z['uid']) + " - " + zone_name,
-                       self.top_level_url, self.access_token)))
-            # time.sleep(1)
-
-        # Collect the program information from the Rainmachine
-        program_data = rm.RmApiGet(self.top_level_url, self.access_token, 'api/4/program')
-        LOGGER.debug("Program data: {}".format(program_data))
-        if program_data is None:
-            LOGGER.error('Can\'t get Rainmachine programs (url {0:s}, access_token {1:s}'.format(self.top_level_url,
-                                                                                                 self.access_token))
-            return
+            address = 'zone' + str(z['uid'])
+            name = 'Zone ' + str(z['uid']) + " - " + zone_name
+            zones.append(self.reuse_node(address, name) or
+                         RmZone(self, self.address, address, name, self.top_level_url, self.access_token))
 
+        programs = []
         for z in program_data['programs']:
             p_name = z['name'].replace('&', 'and')  # replace '& with 'and' in program name
             prog_name = p_name.translate(self.translation_table)  # remove illegal characters from program name
             LOGGER.debug("Program name: {}".format(prog_name))
 
-            self.rmprognode.append(self.addNode(
-                RmProgram(self, self.address, 'program' + str(z['uid']), prog_name, self.top_level_url,
-                          self.access_token)))
-            # time.sleep(1)
+            address = 'program' + str(z['uid'])
+            programs.append(self.reuse_node(address, prog_name) or
+                            RmProgram(self, self.address, address, prog_name, self.top_level_url, self.access_token))
 
         # Set up nodes for rain and qpf data for today and the next 2 days
+        precip = None
         if self.hwver != 1:
-            # self.rmprecipnode = self.addNode(RmPrecip(self, self.address, 'precip', 'Precipitation', self.top_level_url, self.access_token, self.hwver, self.units))
-            self.rmprecipnode = self.addNode(
+            precip = self.reuse_node('precip', 'Precipitation', hwver=self.hwver, units=self.units) or \
                 RmPrecip(self, self.address, 'precip', 'Precipitation', self.top_level_url, self.access_token,
-                         self.hwver, self.units))
+                         self.hwver, self.units)
+
+        # The restrictions information node
+        restrict = self.reuse_node('restrict', 'Restrictions', hwver=self.hwver) or \
+            RmRestrictions(self, self.address, 'restrict', 'Restrictions', self.top_level_url,
+                           self.access_token, self.hwver)
+
+        # The projected watering node
+        daily = self.reuse_node('dailystat', 'Projected Watering') or \
+            RmDailyStats(self, self.address, 'dailystat', 'Projected Watering', self.top_level_url,
+                         self.access_token)
+
+        self.add_nodes(zones + programs + [n for n in (precip, restrict, daily) if n is not None])
+        self.rmzonenode = zones
+        self.rmprognode = programs
+        self.rmprecipnode = precip
+        self.rmrestrictnode = restrict
+        self.rmdailynode = daily
 
-        # Add the restrictions information node
-        self.rmrestrictnode = self.addNode(
-            RmRestrictions(self, self.address, 'restrict', 'Restrictions', self.top_level_url, self.access_token,
-                           self.hwver))
+        # Flow rates for the local water volume estimates
+        self.getZoneProperties()
+
+        # Location and hourly restrictions for the local program schedule, refreshed with the restrictions tier
+        self.getScheduleInputs()
+
+        self.tiers.reset()  # fetch everything for the new nodes on the next cycle
         self.discovery_done = True
 
+    def reuse_node(self, address, name, **attrs):
+        """
+        The node already running at address after a rediscovery, pointed at the current url and token,
+        so its history and water volumes carry on. None if there isn't one yet.
+        """
+        node = self.nodes.get(address)
+        if node is None or node is self:
+            return None
+        node.name = name
+        node.url = self.top_level_url
+        node.token = self.access_token
+        for attr, value in attrs.items():
+            setattr(node, attr, value)
+        return node
+
+    def add_nodes(self, nodes):
+        """
+        Register nodes with Polyglot, keeping at most MAX_ADDS_IN_FLIGHT adds waiting on a reply.
+        Nodes Polyglot already has with the same name and drivers aren't sent again.
+        If Polyglot stops replying for ADD_NODE_TIMEOUT the rest are sent without waiting, so the I/O loop isn't held.
+        """
+        deadline = time.monotonic() + ADD_NODE_TIMEOUT
+        batching = True
+        for node in nodes:
+            known = self._nodes.get(node.address)
+            if known is not None and known.get('name') == node.name and \
+                    {d['driver'] for d in known.get('drivers', [])} == {d['driver'] for d in node.drivers}:
+                LOGGER.debug("{} already exists, not re-adding".format(node.name))
+                if self.nodes.get(node.address) is not node:
+                    self.restore_node(node, known)  # first discovery since the nodeserver started
+                continue
+
+            while batching and len(self.nodesAdding) >= MAX_ADDS_IN_FLIGHT:
+                if time.monotonic() >= deadline:
+                    LOGGER.warning("Polyglot hasn't confirmed nodes {}, adding the rest without waiting".format(
+                        self.nodesAdding))
+                    batching = False
+                    break
+                time.sleep(0.05)
+            self.addNode(node, update=known is not None)
+
+        while batching and self.nodesAdding and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if self.nodesAdding:
+            LOGGER.warning("Polyglot hasn't confirmed nodes {}".format(self.nodesAdding))
+
+    def restore_node(self, node, known):
+        """ What addNode and Polyglot's reply do for an existing node, without sending it to Polyglot again """
+        node._drivers = known['drivers']  # reportDriver compares against these, so values back at their default are sent
+        for driver in node.drivers:
+            for existing in known['drivers']:
+                if driver['driver'] == existing['driver'] and 'value' in existing:
+                    driver['value'] = existing['value']
+        self.nodes[node.address] = node
+        node.start()
+
     def rm_pulse(self):
         # RainMachine Heartbeat
         heartbeat = rm.rmHeartBeat(self.host, self.timeout)
@@ -256,13 +450,14 @@ class RMController(polyinterface.Controller):
         return token
 
     def getZoneUpdate(self):
-        """ This function retrieves the raw zone info from the Rainmachine """
+        """ This function retrieves the raw zone info from the Rainmachine, returns True if the zones were updated """
         zone_data = rm.RmApiGet(self.top_level_url, self.access_token, 'api/4/zone')
         LOGGER.debug("Zone data: {}".format(zone_data))
-        if zone_data is None:
+        if not isinstance(zone_data, dict):
             LOGGER.error(
                 "Can't get Rainmachine zone data {}".format(zone_data))
-            return
+            return False
+        self.cache.put('api/4/zone', zone_data)
 
         try:
             for z in range(int(len(self.rmzonenode))):
@@ -270,53 +465,165 @@ class RMController(polyinterface.Controller):
                 RmZone.set_Driver(self.rmzonenode[z], 'GV3', zone_data['zones'][z]['remaining'])
                 #        RmZone.setnodeDriver( self.rmzonenode[z], 'GV4', zone_data['zone'][z]['remaining'] )
                 RmZone.set_Driver(self.rmzonenode[z], 'GV5', zone_data['zones'][z]['master'])
+                RmZone.update_history(self.rmzonenode[z], zone_data['zones'][z]['state'],
+                                      zone_data['zones'][z]['remaining'])
+                RmZone.anchor_countdown(self.rmzonenode[z], zone_data['zones'][z]['state'],
+                                        zone_data['zones'][z]['remaining'])
+                litres = RmZone.update_volume(self.rmzonenode[z], zone_data['zones'][z]['state'], self.units)
+                self.total_volume += litres
+                uid = zone_data['zones'][z]['uid']
+                self.zone_volume[uid] = self.zone_volume.get(uid, 0.0) + litres
+
+            value, uom = volume.for_units(self.total_volume, self.units)
+            self.setDriver('GV5', value, uom=uom)
 
         except (RuntimeError, TypeError, NameError, OSError) as err:
             LOGGER.error('Unable to update zone data')
             LOGGER.error(err)
+            return False
+        return True
 
     def getProgramUpdate(self):
-        """ Get the latest status info on Rainmachine programs here """
+        """ Get the latest status info on Rainmachine programs here, returns True if the programs were updated """
         program_data = rm.RmApiGet(self.top_level_url, self.access_token, 'api/4/program')
 
-        if program_data is None:
+        if not isinstance(program_data, dict):
             LOGGER.error(
                 "Can't get Rainmachine program data (url {}, access_token {})".format(self.top_level_url,
                                                                                       self.access_token))
-            return
+            return False
 
         LOGGER.debug("Program data: {}".format(program_data))
+        self.cache.put('api/4/program', program_data)
         try:
             for z in range(int(len(self.rmprognode))):
                 status = program_data['programs'][z]['status']
                 RmProgram.set_Driver(self.rmprognode[z], 'ST', status)
                 nextrun = program_data['programs'][z]['nextRun']
                 RmProgram.set_Driver(self.rmprognode[z], 'GV3', nextrun)
+                RmProgram.update_history(self.rmprognode[z], status)
+                # Only the program's own zones, so manual zone runs aren't credited to it
+                litres = sum(self.zone_volume.get(zone.get('id'), 0.0)
+                             for zone in program_data['programs'][z].get('wateringTimes', []))
+                RmProgram.update_volume(self.rmprognode[z], status, litres, self.units)
+                RmProgram.update_schedule(self.rmprognode[z], program_data['programs'][z], self.location,
+                                          self.hourly_restrictions)
+            self.zone_volume = {}
 
         except (RuntimeError, TypeError, NameError, OSError) as err:
             LOGGER.error('Unable to update program data')
             LOGGER.error(err)
+            return False
+        return True
+
+    def getZoneProperties(self):
+        properties = rm.RmApiGet(self.top_level_url, self.access_token, 'api/4/zone/properties')
+        if not isinstance(properties, dict):
+            LOGGER.error("Can't get Rainmachine zone properties, water volumes won't be estimated")
+            return
+
+        for z in properties.get('zones', []):
+            node = self.nodes.get('zone' + str(z['uid']))
+            if node is not None:
+                node.flow_rate = volume.flow_rate(z)
+                LOGGER.debug("{} flow rate {:.2f} l/min".format(node.name, node.flow_rate))
+
+    def getScheduleInputs(self):
+        provision = rm.RmApiGet(self.top_level_url, self.access_token, 'api/4/provision')
+        if isinstance(provision, dict):
+            self.location = provision.get('location')
+        else:
+            LOGGER.error("Can't get Rainmachine location, sunrise/sunset program starts won't be shown")
+
+        hourly = rm.RmApiGet(self.top_level_url, self.access_token, 'api/4/restrictions/hourly')
+        if isinstance(hourly, dict):
+            self.hourly_restrictions = hourly.get('hourlyRestrictions', [])
+        else:
+            LOGGER.error("Can't get Rainmachine hourly restrictions")
 
     def getPrecipNodeUpdate(self):
-        RmPrecip.set_Driver(self.rmprecipnode)
+        mixer_data = RmPrecip.set_Driver(self.rmprecipnode)
+        if mixer_data is None:
+            return False
+        self.cache.put('api/4/mixer', mixer_data)
+        return True
 
     def getRestrictionsUpdate(self):
-        RmRestrictions.set_Driver(self.rmrestrictnode)
+        restrictions = RmRestrictions.set_Driver(self.rmrestrictnode)
+        if restrictions is None:
+            return False
+        self.cache.put('api/4/restrictions/currently', restrictions)
+        return True
+
+    def getDailyStatsUpdate(self):
+        mixer_data = self.rmprecipnode.mixer_data if self.rmprecipnode is not None else None
+        RmDailyStats.set_Driver(self.rmdailynode, self.rmrestrictnode.restrictions, mixer_data)
+
+    def dailyStatsCurrent(self):
+        """ True if getDailyStatsUpdate wouldn't need the device, so the poll cycle doesn't wait on the budget for it """
+        mixer_data = self.rmprecipnode.mixer_data if self.rmprecipnode is not None else None
+        return self.rmdailynode.is_current(self.rmrestrictnode.restrictions, mixer_data)
 
     def delete(self):
         LOGGER.info('Rainmachine Nodeserver deleted')
 
     def stop(self):
+        self.proxy.stop()
+        self.countdown.stop()
+        self.poller.stop()
+        self.loop.stop()
         LOGGER.info('Rainmachine NodeServer stopped.')
 
+    def process_config(self, config):
+        """ Polyglot sends the full config on every change, only act on what actually changed """
+        self.loop.submit(self._process_config, config)
+
+    def _process_config(self, config):
+        if self.params is None:
+            return  # check_params hasn't run yet, start() will pick up this config
+
+        old_host, old_password, old_units = self.params
+        self.set_configuration(config)
+        self.params = (self.host, self.password, self.units)
+        self.apply_proxy()
+        if self.params == (old_host, old_password, old_units):
+            return
+
+        self.remove_config_notices()
+        self.add_config_notices()
+
+        if self.host != old_host or self.password != old_password:
+            LOGGER.info("Hostname or password changed, reconnecting to the Rainmachine")
+            self.access_token = None
+            self.discovery_done = False
+            if not self.winter_mode:
+                self._discover()
+        elif self.units != old_units and self.rmprecipnode is not None:
+            LOGGER.info("Units changed to {}".format(self.units))
+            self.rmprecipnode.units = self.units
+            self.rmprecipnode.render()
+
     def check_params(self):
         self.set_configuration(self.polyConfig)
-        LOGGER.info("Adding configuration")
-        self.addCustomParam({
+        self.add_config_notices()
+        self.params = (self.host, self.password, self.units)
+        self.apply_proxy()
+
+        params = {
             'Hostname': self.host,
             'Password': self.password,
             'Units': self.units,
-        })
+            'QueryMaxAge': self.query_max_age,
+            'RequestRate': self.request_limits[0],
+            'RequestBurst': self.request_limits[1],
+            'ProxyPort': self.proxy_port or '',
+            'ProxyBind': self.proxy_bind,
+        }
+        for param, (endpoint, default) in TIERS.items():
+            params[param] = self.tiers.intervals[endpoint]
+        if not all(key in self.polyConfig['customParams'] for key in params):
+            LOGGER.info("Adding configuration")
+            self.addCustomParam(params)
 
         if 'winterMode' in self.polyConfig['customData']:
             self.winter_mode = self.polyConfig['customData']['winterMode']
@@ -372,13 +679,67 @@ class RMController(polyinterface.Controller):
         else:
             self.units = "metric"
 
+        try:
+            self.query_max_age = int(config['customParams'].get('QueryMaxAge', 60))
+        except ValueError:
+            LOGGER.error("QueryMaxAge must be a number of seconds, using 60")
+            self.query_max_age = 60
+
+        try:
+            limits = (max(0.1, float(config['customParams'].get('RequestRate') or budget.DEFAULT_RATE)),
+                      max(1.0, float(config['customParams'].get('RequestBurst') or budget.DEFAULT_BURST)))
+        except ValueError:
+            LOGGER.error("RequestRate and RequestBurst must be numbers, using the defaults")
+            limits = (budget.DEFAULT_RATE, budget.DEFAULT_BURST)
+        if limits != self.request_limits:
+            LOGGER.info("Request budget: {}/s, burst {}".format(*limits))
+            self.request_limits = limits
+            rm.BUDGET.configure(*limits)
+
+        changed = self.tiers.configure(intervals_from_params(config['customParams'], LOGGER))
+        if changed:
+            LOGGER.info("Poll intervals changed: {}".format(changed))
+
+        self.proxy_bind = config['customParams'].get('ProxyBind') or '127.0.0.1'
+        try:
+            self.proxy_port = int(config['customParams'].get('ProxyPort') or 0) or None
+        except ValueError:
+            LOGGER.error("ProxyPort must be a port number, proxy disabled")
+            self.proxy_port = None
+
+    def apply_proxy(self):
+        """ Start, move or stop the caching proxy to match ProxyBind/ProxyPort """
+        wanted = (self.proxy_bind, self.proxy_port) if self.proxy_port else None
+        if wanted == self.proxy_running:
+            return
+        self.proxy.stop()
+        self.proxy_running = None
+        if wanted is None:
+            return
+        try:
+            self.proxy.start(*wanted)
+            self.proxy_running = wanted
+        except OSError as err:
+            LOGGER.error("Unable to start the Rainmachine proxy on {}:{}: {}".format(wanted[0], wanted[1], err))
+
+    def proxy_passthrough(self, path, query):
+        # Uncached proxy requests queue on the I/O loop as polls, so they share the request budget
+        return self.loop.submit(rm.RmApiRaw, self.top_level_url, self.access_token, path, query)
+
+    def add_config_notices(self):
         # Add a notice?
         if self.host == "":
-            self.addNotice("Hostname (FQDN) or IP address of the Rainmachine device is required.")
+            self.addNotice("Hostname (FQDN) or IP address of the Rainmachine device is required.", 'config_hostname')
         if self.password == "":
-            self.addNotice("Password for Rainmachine is required.")
+            self.addNotice("Password for Rainmachine is required.", 'config_password')
         if self.units == "":
-            self.addNotice("Units to display rain information for ISY Precipitation Node. 'metric' or 'us'")
+            self.addNotice("Units to display rain information for ISY Precipitation Node. 'metric' or 'us'",
+                           'config_units')
+
+    def remove_config_notices(self):
+        # Only the notices add_config_notices adds, others (e.g. poll overruns) stay up
+        for key in CONFIG_NOTICES:
+            self.removeNotice(key)
 
     def remove_notices_all(self, command):
         LOGGER.info('remove_notices_all: notices={}'.format(self.poly.config['notices']))
@@ -407,6 +768,9 @@ class RMController(polyinterface.Controller):
         LOGGER.info("CustomData = {}".format(self.polyConfig['customData']))
 
     def set_winter_mode(self, command):
+        self.loop.submit(self._set_winter_mode, command, priority=budget.COMMAND)
+
+    def _set_winter_mode(self, command):
         LOGGER.debug("Received command {} in 'set_winter_mode'".format(command))
         value = int(command.get('value'))
         if value:
@@ -423,9 +787,13 @@ class RMController(polyinterface.Controller):
         }
         # self.saveCustomData(wm_data)
         self.poly.saveCustomData(wm_data)
-        time.sleep(2)
         LOGGER.debug("CustomData = {}".format(self.polyConfig['customData']))
 
+    def set_profile(self, command):
+        LOGGER.info("Received command {} in 'set_profile'".format(command))
+        cycles = int(command.get('value'))
+        self.loop.submit(self.profiler.arm, cycles, priority=budget.COMMAND)
+
     id = 'RainMachine'
 
     commands = {
@@ -435,13 +803,15 @@ class RMController(polyinterface.Controller):
         'REMOVE_NOTICES_ALL': remove_notices_all,
         'LOG_LEVEL': set_log_level,
         'WINTER': set_winter_mode,
+        'PROFILE': set_profile,
     }
 
     drivers = [
         {'driver': 'ST', 'value': 1, 'uom': 2},
         {'driver': 'GV0', 'value': 0, 'uom': 25},
         {'driver': 'GV3', 'value': 0, 'uom': 2},
-        {'driver': 'GV4', 'value': 0, 'uom': 25}
+        {'driver': 'GV4', 'value': 0, 'uom': 25},
+        {'driver': 'GV5', 'value': 0, 'uom': 35}  # Estimated water used by all zones since the nodeserver started
     ]
 
 
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Request budget for the Rainmachine's embedded web server.
+Every HTTP call to the device takes a token from a shared bucket. The calls all run on the
+one I/O loop thread, so only one is ever in flight and the bucket only has to limit the rate.
+User commands always go through, discovery waits for a token and background polls are
+dropped when the bucket is empty, so the device is never flooded and commands stay fast.
+The poll cycle checks wait_time() first and defers its fetches until there are tokens.
+MIT License
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Priority classes, lower runs first
+COMMAND = 0  # RmZoneCtrl, RmProgramCtrl, RmSetRainDelay from ISY
+DISCOVERY = 1
+POLL = 2
+
+PRIORITY_NAMES = {COMMAND: 'command', DISCOVERY: 'discovery', POLL: 'poll'}
+
+DEFAULT_RATE = 2.0  # requests per second
+DEFAULT_BURST = 8  # a full poll cycle (zone, program, restrictions, mixer, 2x dailystats) with room to spare
+
+_context = threading.local()
+
+
+def current_priority():
+    return getattr(_context, 'priority', POLL)
+
+
+@contextmanager
+def priority(value):
+    """ Run the enclosed device calls in this thread at the given priority class """
+    previous = current_priority()
+    _context.priority = value
+    try:
+        yield
+    finally:
+        _context.priority = previous
+
+
+class RequestBudget(object):
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        self._lock = threading.Lock()
+        self.rate = float(rate)  # tokens added per second
+        self.burst = float(burst)  # bucket size, commands can also borrow up to this much against it
+        self._tokens = float(burst)
+        self._refilled = time.monotonic()
+        self.dropped = 0
+
+    def configure(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST):
+        with self._lock:
+            self._refill()
+            self.rate = float(rate)
+            self.burst = float(burst)
+            self._tokens = max(-self.burst, min(self._tokens, self.burst))
+
+    def wait_time(self, tokens=1):
+        """ Seconds until the bucket holds 'tokens' tokens, 0 if it does now """
+        with self._lock:
+            self._refill()
+            return max(0.0, (min(tokens, self.burst) - self._tokens) / self.rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def take_token(self, prio, timeout=30):
+        """ Take a token for a request of class prio, returns False if the request should be dropped """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1 or prio == COMMAND:
+                    # Commands borrow against the bucket so later polls pay for them, at most a burst's worth
+                    self._tokens = max(-self.burst, self._tokens - 1)
+                    return True
+                if prio == POLL:
+                    self.dropped += 1
+                    return False
+                wait = (1 - self._tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def allow(self, prio=None, timeout=30):
+        """ Take a token for one device request, by default at the calling thread's priority class """
+        if prio is None:
+            prio = current_priority()
+        return self.take_token(prio, timeout)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Timestamped cache of the last data fetched from the Rainmachine, keyed by API endpoint.
+Queries answer from here and only ask for a refresh when the data is older than a max age.
+Concurrent refreshes of the same endpoint share one device call.
+MIT License
+"""
+import threading
+import time
+
+
+class StateCache(object):
+
+    def __init__(self):
+        self._lock = threading.RLock()  # a refresh submitted from the I/O loop runs inline and calls put()
+        self._entries = {}  # key -> (value, fetched_at)
+        self._inflight = {}  # key -> Future of the refresh in progress
+
+    def put(self, key, value, fetched_at=None):
+        if fetched_at is None:
+            fetched_at = time.time()
+        with self._lock:
+            self._entries[key] = (value, fetched_at)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        return None if entry is None else entry[0]
+
+    def fetched_at(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        return None if entry is None else entry[1]
+
+    def age(self, key):
+        fetched = self.fetched_at(key)
+        return None if fetched is None else time.time() - fetched
+
+    def is_stale(self, key, max_age):
+        age = self.age(key)
+        return age is None or age > max_age
+
+    def refresh(self, key, submit):
+        """
+        Start a refresh of key with submit(), a callable returning a Future.
+        If a refresh of key is already running its Future is returned instead of starting another.
+        """
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None and not future.done():
+                return future
+            future = submit()
+            self._inflight[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    def _done(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
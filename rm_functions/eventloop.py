@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Single-owner I/O loop for the Rainmachine nodeserver.
+All device access and node state changes run on one worker thread. Polyglot's poll thread
+and the MQTT command callbacks submit work here and get a concurrent.futures.Future back.
+Work is run in priority order (see rm_functions/budget.py), so a user command queued behind
+a batch of polls is run next.
+MIT License
+"""
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+
+from polyinterface import LOGGER
+
+from rm_functions import budget
+
+
+class EventLoop(object):
+
+    def __init__(self, name='rainmachine-io'):
+        self.name = name
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()  # keeps FIFO order within a priority class
+        self._thread = None
+        self._stopped = False
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        LOGGER.debug("{} loop started".format(self.name))
+
+    def stop(self, timeout=5):
+        if self._thread is None:
+            return
+        self._stopped = True
+        self._queue.put((budget.POLL + 1, next(self._seq), None))
+        if self.in_loop():
+            self._thread = None
+            return
+        self._thread.join(timeout)
+        alive = self._thread.is_alive()
+        self._thread = None
+        # Anyone still waiting on work that will never run gets an error rather than hanging
+        while not alive:
+            try:
+                prio, seq, item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[0].set_exception(RuntimeError("{} loop stopped".format(self.name)))
+
+    def in_loop(self):
+        return threading.current_thread() is self._thread
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs) to run on the loop thread, returns a Future for the result.
+        Pass priority=budget.COMMAND or budget.DISCOVERY to jump ahead of polls, the default is budget.POLL.
+        """
+        prio = kwargs.pop('priority', budget.POLL)
+        future = Future()
+        if self._stopped:
+            future.set_exception(RuntimeError("{} loop is stopped".format(self.name)))
+        elif self.in_loop():
+            # Already on the loop, run inline rather than queueing behind ourselves
+            self._execute(future, prio, fn, args, kwargs)
+        else:
+            self._queue.put((prio, next(self._seq), (future, fn, args, kwargs)))
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        """ Run fn on the loop thread and wait for its result """
+        return self.submit(fn, *args, **kwargs).result()
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            prio, seq, item = self._queue.get()
+            if item is None:
+                break
+            future, fn, args, kwargs = item
+            self._execute(future, prio, fn, args, kwargs)
+        LOGGER.debug("{} loop stopped".format(self.name))
+
+    @staticmethod
+    def _execute(future, prio, fn, args, kwargs):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            with budget.priority(min(prio, budget.current_priority())):
+                result = fn(*args, **kwargs)
+        except Exception as err:
+            LOGGER.error("Error in {}: {}".format(getattr(fn, '__name__', fn), err), exc_info=True)
+            future.set_exception(err)
+        else:
+            future.set_result(result)
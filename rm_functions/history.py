@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Fixed-memory state history for Rainmachine zones and programs.
+Only state changes are stored: each finished run is one (start, end) pair in a circular
+buffer backed by typed arrays, so memory use is fixed no matter how long the nodeserver runs
+or how often it polls. Runtime over the window is kept as a running total, runs are only
+subtracted as they age out of it.
+MIT License
+"""
+import time
+from array import array
+
+RUNNING = 1  # zone and program state value reported by the Rainmachine while watering
+
+DEFAULT_WINDOW = 86400  # seconds of runtime reported
+DEFAULT_CAPACITY = 1024  # runs kept, far more than a zone starts in a day even with cycle and soak
+MAX_SAMPLE_GAP = 300  # don't count running time across gaps longer than this (nodeserver down, network lost)
+
+
+class StateHistory(object):
+
+    def __init__(self, window=DEFAULT_WINDOW, capacity=DEFAULT_CAPACITY):
+        self.window = window
+        self.capacity = capacity
+        self._start = array('d', [0.0]) * capacity
+        self._end = array('d', [0.0]) * capacity
+        self._head = 0  # index of the next slot to be written
+        self._count = 0
+        self._total = 0.0  # seconds run by the stored runs
+        self._run_start = None  # start of the run in progress
+        self._last_seen = None  # time of the last sample
+        self._state = None
+        self._remaining = 0
+        self._last_run = None  # last time seen running
+
+    def __len__(self):
+        return self._count
+
+    def append(self, state, remaining=0, ts=None):
+        if ts is None:
+            ts = time.time()
+        state = int(state or 0)
+
+        if self._run_start is not None and ts - self._last_seen > MAX_SAMPLE_GAP:
+            # Lost track of the entity, close the run where we last knew it was running
+            self._close_run(self._last_seen + MAX_SAMPLE_GAP)
+        if state == RUNNING:
+            if self._run_start is None:
+                self._run_start = ts
+            self._last_run = ts
+        elif self._run_start is not None:
+            self._close_run(ts)
+
+        self._state = state
+        self._remaining = int(remaining or 0)
+        self._last_seen = ts
+
+    def latest(self):
+        if self._last_seen is None:
+            return None
+        return self._last_seen, self._state, self._remaining
+
+    def runs(self):
+        """ Yield (start, end) of the stored finished runs, oldest first """
+        first = (self._head - self._count) % self.capacity
+        for n in range(self._count):
+            i = (first + n) % self.capacity
+            yield self._start[i], self._end[i]
+
+    def runtime(self, now=None):
+        """ Seconds spent in the running state during the last window seconds """
+        if now is None:
+            now = time.time()
+        window_start = now - self.window
+        self._expire(window_start)
+
+        total = self._total
+        if self._count:
+            oldest = (self._head - self._count) % self.capacity
+            total -= max(0.0, min(self._end[oldest], window_start) - self._start[oldest])  # partly out of the window
+        if self._run_start is not None:
+            end = min(now, self._last_seen + MAX_SAMPLE_GAP)
+            total += max(0.0, end - max(self._run_start, window_start))
+        return total
+
+    def time_since_last_run(self, now=None):
+        """ Seconds since the entity was last seen running, 0 if it is running now, None if never seen running """
+        if self._last_run is None:
+            return None
+        if now is None:
+            now = time.time()
+        if self._state == RUNNING:
+            return 0.0
+        return max(0.0, now - self._last_run)
+
+    def _close_run(self, end):
+        if self._count == self.capacity:
+            oldest = (self._head - self._count) % self.capacity
+            self._total -= self._end[oldest] - self._start[oldest]
+            self._count -= 1
+        self._start[self._head] = self._run_start
+        self._end[self._head] = end
+        self._total += end - self._run_start
+        self._head = (self._head + 1) % self.capacity
+        self._count += 1
+        self._run_start = None
+
+    def _expire(self, window_start):
+        while self._count:
+            oldest = (self._head - self._count) % self.capacity
+            if self._end[oldest] > window_start:
+                return
+            self._total -= self._end[oldest] - self._start[oldest]
+            self._count -= 1
+        self._total = 0.0  # nothing stored, drop any float drift
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Non-overlapping poll scheduling for the Rainmachine nodeserver.
+A PollGuard keeps at most one cycle of its kind queued or running. Ticks that arrive while a
+cycle is still in flight are counted as overruns and folded into a single catch-up cycle run
+straight after, so a slow device or network never builds a backlog of polls.
+MIT License
+"""
+import threading
+import time
+
+from polyinterface import LOGGER
+
+OVERRUN_NOTICE = 3  # consecutive overrun ticks before the on_overrun callback is told
+
+
+class PollGuard(object):
+
+    def __init__(self, name, submit, cycle, on_overrun=None, notice_after=OVERRUN_NOTICE):
+        self.name = name
+        self._submit = submit  # e.g. EventLoop.submit
+        self._cycle = cycle
+        self._on_overrun = on_overrun  # called with (guard, persisting) when overruns start or clear
+        self.notice_after = notice_after
+        self._lock = threading.RLock()  # tick() may run the cycle inline when called from the I/O loop
+        self._future = None
+        self._started = None
+        self._catch_up = False
+        self.overruns = 0  # total since start
+        self.consecutive_overruns = 0
+        self.cycles = 0
+        self.last_duration = 0.0
+        self._noticed = False
+
+    def tick(self):
+        """ Called on every poll interval, returns the Future of the new cycle or None if one was already in flight """
+        notify = None
+        future = None
+        with self._lock:
+            if self._future is not None and not self._future.done():
+                self.overruns += 1
+                self.consecutive_overruns += 1
+                self._catch_up = True
+                LOGGER.warning("{} still running after {:.1f}s, coalescing tick ({} overruns in a row)".format(
+                    self.name, self.running_for(), self.consecutive_overruns))
+                if self.consecutive_overruns >= self.notice_after and not self._noticed:
+                    self._noticed = notify = True
+            else:
+                if self._noticed:
+                    self._noticed = notify = False
+                self.consecutive_overruns = 0
+                self._future = future = self._submit(self._run)
+
+        if notify is not None:
+            self._notify(notify)
+        return future
+
+    def running_for(self):
+        started = self._started
+        return 0.0 if started is None else time.monotonic() - started
+
+    def _run(self):
+        while True:
+            self._started = time.monotonic()
+            try:
+                self._cycle()
+            finally:
+                self.cycles += 1
+                self.last_duration = time.monotonic() - self._started
+                LOGGER.debug("{} cycle took {:.2f}s".format(self.name, self.last_duration))
+            with self._lock:
+                if not self._catch_up:
+                    self._started = None
+                    return
+                self._catch_up = False
+            LOGGER.info("{} running a catch-up cycle for missed ticks".format(self.name))
+
+    def _notify(self, persisting):
+        if self._on_overrun is None:
+            return
+        try:
+            self._on_overrun(self, persisting)
+        except Exception as err:
+            LOGGER.error("{} overrun callback failed: {}".format(self.name, err))
+
+
+class Ticker(object):
+    """ Calls fn every interval seconds on its own daemon thread until stopped """
+
+    def __init__(self, name, interval, fn):
+        self.name = name
+        self.interval = interval
+        self._fn = fn
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self._fn()
+            except Exception as err:
+                LOGGER.error("{} tick failed: {}".format(self.name, err))
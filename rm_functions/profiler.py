@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Opt-in profiling of the Rainmachine nodeserver's poll cycles.
+When armed for N cycles it runs each step of a cycle under cProfile, tracks allocations with
+tracemalloc and samples the running stack for a flamegraph. A cycle is sequenced on the poll
+thread but its steps run on the I/O loop, so the steps are profiled on the thread they run on.
+After the last cycle it writes the reports to the logs directory and switches itself off.
+MIT License
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from polyinterface import LOGGER
+
+LOG_DIR = 'logs'
+SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+TOP_ENTRIES = 40
+
+
+class PollProfiler(object):
+
+    def __init__(self, log_dir=LOG_DIR):
+        self.log_dir = log_dir
+        self.remaining = 0
+        self._profile = None
+        self._stacks = Counter()
+        self._cycles = 0
+        self._in_cycle = False
+        self._started_tracemalloc = False
+
+    @property
+    def active(self):
+        return self.remaining > 0
+
+    def arm(self, cycles):
+        """ Profile the next 'cycles' poll cycles """
+        if cycles <= 0:
+            return
+        if not self.active:
+            self._profile = cProfile.Profile()
+            self._stacks = Counter()
+            self._cycles = 0
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+                self._started_tracemalloc = True
+        self.remaining = cycles
+        LOGGER.info("Profiling the next {} poll cycles".format(cycles))
+
+    def wrap(self, cycle):
+        """ Return cycle wrapped so it is counted and its steps are profiled while armed """
+        def profiled_cycle():
+            if not self.active:
+                return cycle()
+            return self._run(cycle)
+        profiled_cycle.__name__ = getattr(cycle, '__name__', 'cycle')
+        return profiled_cycle
+
+    def step(self, fn):
+        """ Return fn wrapped so it is profiled when it runs as part of a profiled cycle """
+        def profiled_step(*args, **kwargs):
+            if not self._in_cycle:
+                return fn(*args, **kwargs)
+            done = threading.Event()
+            sampler = threading.Thread(target=self._sample, args=(threading.get_ident(), done),
+                                       name='rainmachine-profiler', daemon=True)
+            sampler.start()
+            self._profile.enable()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._profile.disable()
+                done.set()
+                sampler.join()
+        profiled_step.__name__ = getattr(fn, '__name__', 'step')
+        return profiled_step
+
+    def _run(self, cycle):
+        self._in_cycle = True
+        try:
+            return cycle()
+        finally:
+            self._in_cycle = False
+            self._cycles += 1
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self._finish()
+
+    def _sample(self, ident, done):
+        while not done.wait(SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(ident)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self._stacks[';'.join(reversed(stack))] += 1
+
+    def _finish(self):
+        self.remaining = 0
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        base = os.path.join(self.log_dir, 'profile-' + stamp)
+        try:
+            os.makedirs(self.log_dir, exist_ok=True)
+            self._write_cpu(base + '-cpu.txt')
+            self._write_memory(base + '-memory.txt')
+            self._write_stacks(base + '-stacks.folded')
+            LOGGER.info("Profiling done, {} cycles written to {}-*".format(self._cycles, base))
+        except OSError as err:
+            LOGGER.error("Unable to write profile reports: {}".format(err))
+        finally:
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+            self._profile = None
+            self._stacks = Counter()
+
+    def _write_cpu(self, path):
+        with open(path, 'w') as outfile:
+            for sort in ('cumulative', 'tottime'):
+                out = io.StringIO()
+                stats = pstats.Stats(self._profile, stream=out)
+                stats.sort_stats(sort).print_stats(TOP_ENTRIES)
+                outfile.write("==== {} cycles sorted by {} ====\n".format(self._cycles, sort))
+                outfile.write(out.getvalue())
+
+    def _write_memory(self, path):
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        with open(path, 'w') as outfile:
+            outfile.write("Traced memory: current {} bytes, peak {} bytes\n\n".format(current, peak))
+            for stat in snapshot.statistics('lineno')[:TOP_ENTRIES]:
+                outfile.write("{}\n".format(stat))
+
+    def _write_stacks(self, path):
+        # One "frame;frame;frame count" line per stack, the input format of flamegraph.pl and speedscope
+        with open(path, 'w') as outfile:
+            for stack, count in self._stacks.most_common():
+                outfile.write("{} {}\n".format(stack, count))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Optional read-through HTTP proxy serving the nodeserver's Rainmachine data to other systems.
+The endpoints the nodeserver already polls are answered from its cache with Cache-Control
+headers, anything else is passed to the device through the nodeserver's request budget, so
+the Rainmachine sees one consumer no matter how many tools are polling it.
+Only GET is supported. Clients don't need an access token, so bind to a trusted interface.
+MIT License
+"""
+import json
+import threading
+from concurrent.futures import TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from polyinterface import LOGGER
+
+from rm_functions.rmfuncs import RequestDropped
+
+PASSTHROUGH_TIMEOUT = 30  # seconds a client waits for a passed-through request
+# Endpoints whose cache entry is the device's own response for that exact path. The mixer entry is the
+# nodeserver's merged weather window, not a device response, so mixer requests are passed through.
+CACHED_ENDPOINTS = ('api/4/zone', 'api/4/program', 'api/4/restrictions/currently')
+
+
+class CachingProxy(object):
+
+    def __init__(self, cache, max_age, passthrough, on_stale=None):
+        self.cache = cache
+        self.max_age = max_age  # max_age(endpoint) -> seconds before its cached data is stale
+        self._passthrough = passthrough  # passthrough(path, query) -> Future of (status, body, content type)
+        self._on_stale = on_stale  # on_stale(endpoint) asks for a background refresh
+        self._server = None
+        self._thread = None
+        self.address = None
+
+    def start(self, bind, port):
+        self.stop()
+        handler = type('ProxyHandler', (_ProxyHandler,), {'proxy': self})
+        self._server = ThreadingHTTPServer((bind, port), handler)
+        self._server.daemon_threads = True
+        self.address = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, name='rainmachine-proxy', daemon=True)
+        self._thread.start()
+        LOGGER.info("Rainmachine proxy listening on {}:{}".format(*self.address))
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        self._thread = None
+        LOGGER.info("Rainmachine proxy stopped")
+
+    def cached(self, endpoint):
+        """ (body, age, max age) for a cached endpoint, None if it isn't cached """
+        value = self.cache.get(endpoint)
+        if value is None:
+            return None
+        age = self.cache.age(endpoint)
+        max_age = self.max_age(endpoint)
+        if age > max_age and self._on_stale is not None:
+            self._on_stale(endpoint)  # serve what we have, the refresh is shared with any other
+        return json.dumps(value).encode(), age, max_age
+
+    def passthrough(self, path, query):
+        return self._passthrough(path, query).result(timeout=PASSTHROUGH_TIMEOUT)
+
+
+class _ProxyHandler(BaseHTTPRequestHandler):
+    proxy = None
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        path = parts.path.strip('/')
+        # The nodeserver uses its own token, never forward one from the client
+        query = urlencode([(k, v) for k, v in parse_qsl(parts.query) if k != 'access_token'])
+
+        if not path.startswith('api/4/'):
+            self._reply(404, b'{"error": "not found"}')
+            return
+
+        if path in CACHED_ENDPOINTS and not query:
+            cached = self.proxy.cached(path)
+            if cached is not None:
+                body, age, max_age = cached
+                self._reply(200, body, headers={
+                    'Cache-Control': 'max-age={}'.format(max(0, int(max_age - age))),
+                    'Age': str(int(age)),
+                })
+                return
+
+        try:
+            status, body, content_type = self.proxy.passthrough(path, query)
+        except RequestDropped:
+            self._reply(503, b'{"error": "rainmachine busy"}', headers={'Retry-After': '5'})
+            return
+        except TimeoutError:
+            self._reply(504, b'{"error": "rainmachine timed out"}')
+            return
+        except Exception as err:
+            LOGGER.error("Proxy request for {} failed: {}".format(path, err))
+            self._reply(502, b'{"error": "rainmachine unavailable"}')
+            return
+        self._reply(status, body, content_type=content_type, headers={'Cache-Control': 'no-cache'})
+
+    def _method_not_allowed(self):
+        self._reply(405, b'{"error": "read only"}', headers={'Allow': 'GET'})
+
+    do_POST = do_PUT = do_DELETE = do_PATCH = _method_not_allowed
+
+    def _reply(self, status, body, content_type='application/json', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        LOGGER.debug("Proxy: " + fmt % args)
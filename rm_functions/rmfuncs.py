@@ -12,19 +12,38 @@ import requests
 import urllib3
 from polyinterface import LOGGER
 
+from rm_functions import budget
+
 urllib3.disable_warnings()
 
+REQUEST_TIMEOUT = 10  # seconds, a hung request would otherwise hold the I/O loop forever
+BUDGET = budget.RequestBudget()
+
+
+class RequestDropped(requests.exceptions.RequestException):
+    """ The request budget refused a background request, callers treat it like any network error """
+
+
+def _request(method, url, **kwargs):
+    # All device HTTP calls go through here so they share the request budget
+    kwargs.setdefault('verify', False)
+    kwargs.setdefault('timeout', REQUEST_TIMEOUT)
+    if not BUDGET.allow():
+        raise RequestDropped("Request budget exhausted, skipped {}".format(url.split('?')[0]))
+    return requests.request(method, url, **kwargs)
+
+
 def getRainMachineVersion(url):
 
     try:
-        response = requests.get(url + ":8080/api/4/apiVer", verify=False)
+        response = _request('GET', url + ":8080/api/4/apiVer")
         LOGGER.info("Found Rainmachine on port 8080")
         LOGGER.debug("API Response: {0}, content {1}".format(response, response.content))
         #return json.loads(response.content)
         return response.json()
 
     except OSError:
-        response = requests.get(url + ":443/api/4/apiVer", verify=False)
+        response = _request('GET', url + ":443/api/4/apiVer")
         LOGGER.info("Found Rainmachine on port 443")
         #return json.loads(response.content)
         return response.json()
@@ -46,8 +65,8 @@ def getRainmachineToken(password, top_level_url):
         'Content-Type': 'application/json'
     }
     try:
-        r = requests.post(top_level_url + api_request, data=json.dumps(data), headers=headers, verify=False)
-        if r.status_code is 200:
+        r = _request('POST', top_level_url + api_request, data=json.dumps(data), headers=headers)
+        if r.status_code == 200:
             rmdata = r.json()
             access_token = rmdata['access_token']
             return access_token
@@ -61,8 +80,8 @@ def getRainmachineToken(password, top_level_url):
 def RmApiGet(url, access_token,api_call):
     # call to acquire data from Rainmachine
     try:
-        response = requests.get(url + api_call + access_token, verify=False)
-        if response.status_code is 200:
+        response = _request('GET', url + api_call + access_token)
+        if response.status_code == 200:
             rm_data = response.json()
         else:
             return response.status_code
@@ -73,6 +92,11 @@ def RmApiGet(url, access_token,api_call):
 
     return rm_data
 
+def RmApiRaw(url, access_token, api_call, query=''):
+    # Unparsed GET for the caching proxy, errors are left to the caller
+    response = _request('GET', url + api_call + access_token + ('&' + query if query else ''))
+    return response.status_code, response.content, response.headers.get('Content-Type', 'application/json')
+
 def rmHeartBeat(host, timeout):
 
     try:
@@ -104,7 +128,7 @@ def rmHeartBeat(host, timeout):
 
 def GetRmRestrictions(url, access_token):
     try:
-        response = requests.get(url + 'api/4/restrictions/currently' + access_token, verify=False)
+        response = _request('GET', url + 'api/4/restrictions/currently' + access_token)
         rm_data = response.json()
         #LOGGER.debug("GetRmRestrictions data: {}".format(rm_data))
         return rm_data
@@ -115,7 +139,7 @@ def GetRmRestrictions(url, access_token):
 
 def RmZoneProperties(url, access_token):
     try:
-        response = requests.get(url + 'api/4/zone' + access_token, verify=False)
+        response = _request('GET', url + 'api/4/zone' + access_token)
         #rm_zone_data = json.loads(response.content)
         rm_zone_data = response.json()
         return rm_zone_data
@@ -128,7 +152,7 @@ def RmZoneCtrl(url, access_token, command):
     zone = ''.join(filter(lambda i: i.isdigit(), command['address']))
     if command['cmd'] == 'STOP':
         try:
-            response = requests.post(url + 'api/4/zone/' + str(zone) + "/stop" + access_token, data=None, json=None, verify=False)
+            response = _request('POST', url + 'api/4/zone/' + str(zone) + "/stop" + access_token, data=None)
             LOGGER.debug(response)
             LOGGER.debug('Received Stop Command')
         except:
@@ -140,8 +164,7 @@ def RmZoneCtrl(url, access_token, command):
         LOGGER.debug("Zone duration: {}".format(zone_duration))
         #'{"time":60}'
         try:
-            response = requests.post(url + 'api/4/zone/' + str(zone) + "/start" + access_token, data=zone_duration, json=None,
-                                     verify=False)
+            response = _request('POST', url + 'api/4/zone/' + str(zone) + "/start" + access_token, data=zone_duration)
             LOGGER.debug('Received Run Command')
             LOGGER.debug(response.url)
         except:
@@ -153,7 +176,7 @@ def RmProgramCtrl(url, access_token, command):
     program = ''.join(filter(lambda i: i.isdigit(), command['address']))
     if command['cmd'] == 'STOP':
         try:
-            response = requests.post(url + 'api/4/program/' + str(program) + "/stop" + access_token, data=None, json=None, verify=False)
+            response = _request('POST', url + 'api/4/program/' + str(program) + "/stop" + access_token, data=None)
             LOGGER.debug(response)
             LOGGER.debug('Received Stop Command')
         except:
@@ -165,8 +188,7 @@ def RmProgramCtrl(url, access_token, command):
         #LOGGER.debug(zone_duration)
         #'{"time":60}'
         try:
-            response = requests.post(url + 'api/4/program/' + str(program) + "/start" + access_token, data=None, json=None,
-                                     verify=False)
+            response = _request('POST', url + 'api/4/program/' + str(program) + "/start" + access_token, data=None)
             LOGGER.debug('Received Run Command')
             LOGGER.debug(response.url)
         except:
@@ -180,8 +202,7 @@ def RmSetRainDelay(url, access_token, command):
     }
 
     try:
-        response = requests.post(url + 'api/4/restrictions/raindelay' + access_token, data=json.dumps(data), json=None,
-                             verify=False)
+        response = _request('POST', url + 'api/4/restrictions/raindelay' + access_token, data=json.dumps(data))
         LOGGER.debug("SetRainDelay response: {}".format(response))
     except:
         LOGGER.error("Rain delay update failed")
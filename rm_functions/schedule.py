@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Local schedule engine for Rainmachine programs.
+Works out the start and end times of each program's upcoming runs from its definition in
+api/4/program (frequency, start time or sun offset, zone durations, cycle/soak and zone delay),
+the device location from api/4/provision and the hourly windows from api/4/restrictions/hourly.
+The timeline is only recomputed when the definition changes or the horizon needs extending,
+so the drivers built on it need no extra device calls.
+MIT License
+"""
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+from math import acos, cos, degrees, pi, radians, sin, tan
+
+HORIZON_DAYS = 7
+
+# frequency['type'] values used by the Rainmachine
+FREQ_DAILY = 0
+FREQ_EVERY_N_DAYS = 1
+FREQ_WEEKDAYS = 2
+FREQ_ODD_EVEN = 4
+
+# startTimeParams['type'] values
+START_FIXED = 0
+START_SUNRISE = 1
+START_SUNSET = 2
+
+
+def sun_times(day, latitude, longitude):
+    """ Local sunrise and sunset for a date as naive datetimes (NOAA approximation), (None, None) in polar day or night """
+    g = 2 * pi / 365 * (day.timetuple().tm_yday - 1)
+    eqtime = 229.18 * (0.000075 + 0.001868 * cos(g) - 0.032077 * sin(g) - 0.014615 * cos(2 * g)
+                       - 0.040849 * sin(2 * g))
+    decl = (0.006918 - 0.399912 * cos(g) + 0.070257 * sin(g) - 0.006758 * cos(2 * g) + 0.000907 * sin(2 * g)
+            - 0.002697 * cos(3 * g) + 0.00148 * sin(3 * g))
+    lat = radians(latitude)
+    cos_ha = cos(radians(90.833)) / (cos(lat) * cos(decl)) - tan(lat) * tan(decl)
+    if abs(cos_ha) > 1:
+        return None, None
+    ha = degrees(acos(cos_ha))
+
+    midnight = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    sunrise = midnight + timedelta(minutes=720 - 4 * (longitude + ha) - eqtime)
+    sunset = midnight + timedelta(minutes=720 - 4 * (longitude - ha) - eqtime)
+    return sunrise.astimezone().replace(tzinfo=None), sunset.astimezone().replace(tzinfo=None)
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+class ProgramSchedule(object):
+
+    def __init__(self, horizon_days=HORIZON_DAYS):
+        self.horizon_days = horizon_days
+        self.timeline = []  # [(start, end), ...] naive local datetimes, sorted
+        self.duration = 0  # expected run length in seconds
+        self._fingerprint = None
+        self._computed_for = None  # date the timeline horizon starts on
+
+    def update(self, program, location=None, hourly_restrictions=None, today=None):
+        """ Recompute the timeline if the inputs changed or the day rolled over, returns True if it was recomputed """
+        if today is None:
+            today = datetime.now().date()
+        fingerprint = self.fingerprint(program, location, hourly_restrictions)
+        if fingerprint == self._fingerprint and today == self._computed_for:
+            return False
+
+        self._fingerprint = fingerprint
+        self._computed_for = today
+        self.duration = self.run_duration(program)
+        self.timeline = []
+        if not program.get('active', True):
+            return True
+
+        for offset in range(self.horizon_days):
+            day = today + timedelta(days=offset)
+            if not self.runs_on(program, day):
+                continue
+            start = self.start_time(program, day, location)
+            if start is None:
+                continue
+            end = start + timedelta(seconds=self.duration)
+            if self.restricted(start, end, hourly_restrictions):
+                continue
+            self.timeline.append((start, end))
+        self.timeline.sort()
+        return True
+
+    def next_run(self, now=None):
+        """ (start, end) of the next run that hasn't finished yet, or None if there is none within the horizon """
+        if now is None:
+            now = datetime.now()
+        for start, end in self.timeline:
+            if end > now:
+                return start, end
+        return None
+
+    def minutes_until_next_run(self, now=None):
+        """ Minutes to the next start, 0 while a run is in progress, -1 if nothing is scheduled """
+        if now is None:
+            now = datetime.now()
+        run = self.next_run(now)
+        if run is None:
+            return -1
+        return max(0, int((run[0] - now).total_seconds() // 60))
+
+    @staticmethod
+    def fingerprint(program, location, hourly_restrictions):
+        # Leave out the status so a program starting or stopping doesn't force a recompute, nextRun anchors the timeline
+        definition = {k: v for k, v in program.items() if k != 'status'}
+        data = json.dumps([definition, location, hourly_restrictions], sort_keys=True, default=str)
+        return hashlib.sha1(data.encode()).hexdigest()
+
+    @staticmethod
+    def run_duration(program):
+        zones = [z for z in program.get('wateringTimes', []) if z.get('active') and z.get('duration')]
+        seconds = sum(z['duration'] for z in zones)
+
+        if program.get('cs_on') and program.get('cycles', 0) > 1:
+            # Each zone's time is split over the cycles with a soak (minutes) in between
+            seconds += (program['cycles'] - 1) * program.get('soak', 0) * 60
+        if program.get('delay_on') and len(zones) > 1:
+            seconds += (len(zones) - 1) * program.get('delay', 0)
+        return seconds
+
+    @staticmethod
+    def runs_on(program, day):
+        start_date = _parse_date(program.get('startDate'))
+        end_date = _parse_date(program.get('endDate'))
+        if start_date is not None and day < start_date:
+            return False
+        if end_date is not None and day > end_date:
+            return False
+
+        frequency = program.get('frequency') or {}
+        freq_type = frequency.get('type')
+        param = str(frequency.get('param', '0'))
+
+        if freq_type == FREQ_DAILY:
+            return True
+        if freq_type == FREQ_EVERY_N_DAYS:
+            interval = max(1, int(param)) if param.isdigit() else 1
+            # The device's own next run keeps the phase right after skipped or manual runs
+            next_run = _parse_date(program.get('nextRun'))
+            if next_run is not None and day < next_run:
+                return False
+            anchor = next_run or start_date or day
+            return (day - anchor).days % interval == 0
+        if freq_type == FREQ_WEEKDAYS:
+            # param is a string of seven 0/1 flags, Monday first
+            days = param[-7:].rjust(7, '0')
+            return days[day.weekday()] == '1'
+        if freq_type == FREQ_ODD_EVEN:
+            # param '0' waters on even days of the month, '1' on odd days
+            return day.day % 2 == int(param == '1')
+
+        # Unknown frequency, trust the device's own next run date
+        return _parse_date(program.get('nextRun')) == day
+
+    @staticmethod
+    def start_time(program, day, location):
+        params = program.get('startTimeParams') or {}
+        start_type = params.get('type', START_FIXED)
+
+        if start_type in (START_SUNRISE, START_SUNSET):
+            if not location or location.get('latitude') is None or location.get('longitude') is None:
+                return None
+            sunrise, sunset = sun_times(day, float(location['latitude']), float(location['longitude']))
+            base = sunrise if start_type == START_SUNRISE else sunset
+            if base is None:
+                return None
+            base = base.replace(second=0, microsecond=0)
+            offset = timedelta(minutes=params.get('offsetMinutes', 0))
+            # offsetSign 0 is before the sun event, 1 after
+            return base - offset if params.get('offsetSign', 0) == 0 else base + offset
+
+        try:
+            hour, minute = (int(x) for x in program.get('startTime', '').split(':'))
+        except ValueError:
+            return None
+        return datetime(day.year, day.month, day.day, hour, minute)
+
+    @staticmethod
+    def restricted(start, end, hourly_restrictions):
+        """ True if the run from start to end overlaps an hourly restriction window, the device won't water then """
+        end = max(end, start + timedelta(minutes=1))
+        for window in hourly_restrictions or []:
+            days = str(window.get('weekDays', '1111111')).rjust(7, '0')
+            duration = timedelta(minutes=window.get('minuteDuration', 0))
+            # A window belongs to the weekday it starts on and can run past midnight, so start from the day before
+            day = start.date() - timedelta(days=1)
+            while day <= end.date():
+                if days[day.weekday()] == '1':
+                    begin = datetime(day.year, day.month, day.day) + timedelta(minutes=window.get('dayStartMinute', 0))
+                    if begin < end and start < begin + duration:
+                        return True
+                day += timedelta(days=1)
+        return False
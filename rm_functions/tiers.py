@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Per-endpoint polling tiers for the Rainmachine nodeserver.
+Each endpoint has its own interval, set from a custom param, and is only fetched when its
+interval has passed. Intervals can be changed at runtime without losing track of when each
+endpoint was last fetched.
+MIT License
+"""
+import threading
+import time
+
+# custom param -> (endpoint, default interval in seconds)
+TIERS = {
+    'ZonePoll': ('api/4/zone', 30),
+    'ProgramPoll': ('api/4/program', 30),
+    'HeartbeatPoll': ('heartbeat', 60),
+    'RestrictionsPoll': ('api/4/restrictions/currently', 600),
+    'MixerPoll': ('api/4/mixer', 3600),
+}
+
+SLACK = 1  # seconds, so a tier matching the shortPoll interval isn't pushed to every other tick by timer jitter
+
+
+def intervals_from_params(params, logger=None):
+    """ {endpoint: seconds} from the custom params, defaults for anything missing or invalid """
+    intervals = {}
+    for param, (endpoint, default) in TIERS.items():
+        value = params.get(param)
+        try:
+            intervals[endpoint] = max(1, int(value)) if value not in (None, '') else default
+        except ValueError:
+            if logger is not None:
+                logger.error("{} must be a number of seconds, using {}".format(param, default))
+            intervals[endpoint] = default
+    return intervals
+
+
+class TierSchedule(object):
+
+    def __init__(self, intervals=None):
+        self._lock = threading.Lock()
+        self.intervals = intervals or {endpoint: default for endpoint, default in TIERS.values()}
+        self._last = {}  # endpoint -> time of the last fetch
+
+    def configure(self, intervals):
+        with self._lock:
+            changed = {k: v for k, v in intervals.items() if self.intervals.get(k) != v}
+            self.intervals = dict(intervals)
+        return changed
+
+    def due(self, now=None):
+        """ Endpoints whose interval has passed, in TIERS order """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            return [endpoint for endpoint, interval in self.intervals.items()
+                    if endpoint not in self._last or now - self._last[endpoint] >= interval - SLACK]
+
+    def done(self, endpoint, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            self._last[endpoint] = now
+
+    def reset(self):
+        """ Make every endpoint due, e.g. after a rediscovery """
+        with self._lock:
+            self._last.clear()
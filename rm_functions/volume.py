@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Water volume estimates for Rainmachine zones.
+Flow rates come once from api/4/zone/properties, volumes are then accumulated locally
+from the polled zone state and the time between polls.
+MIT License
+"""
+LITRES_PER_US_GALLON = 3.785411784
+
+UOM_LITRE = 35
+UOM_US_GALLON = 69
+
+
+def flow_rate(properties):
+    """ Zone flow in litres per minute from its properties, 0 if it can't be worked out """
+    water_sense = properties.get('waterSense') or {}
+
+    # A flow rate entered by the user in the Rainmachine app takes precedence, it is stored in litres per minute
+    flowrate = water_sense.get('flowrate')
+    if flowrate:
+        return float(flowrate)
+
+    # Otherwise precipitation rate (mm/h) over the zone area (m2), 1 mm on 1 m2 is one litre
+    precip_rate = water_sense.get('precipitationRate')
+    area = water_sense.get('area')
+    if precip_rate and area:
+        return float(precip_rate) * float(area) / 60
+    return 0.0
+
+
+def for_units(litres, units):
+    """ (value, uom) for an ISY driver in the configured units """
+    if units == 'metric':
+        return round(litres, 1), UOM_LITRE
+    return round(litres / LITRES_PER_US_GALLON, 1), UOM_US_GALLON
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Weather and ET analytics over a rolling window of Rainmachine mixer data.
+The window (HISTORY_DAYS back, FORECAST_DAYS forward) is held in NumPy arrays and refreshed
+incrementally: a day's data is final once it has been stored after that day ended, so only the
+day that was current at the last fetch onwards is fetched again.
+MIT License
+"""
+from datetime import date, timedelta
+
+import numpy as np
+
+HISTORY_DAYS = 30
+FORECAST_DAYS = 7
+SKIP_DAYS = 3  # forecast days looked at for the rain-skip likelihood
+MM_PER_INCH = 25.4
+
+
+def _value(record, *keys):
+    for key in keys:
+        if record.get(key) is not None:
+            return float(record[key])
+    return np.nan
+
+
+class MixerWindow(object):
+
+    def __init__(self, history_days=HISTORY_DAYS, forecast_days=FORECAST_DAYS):
+        self.history_days = history_days
+        self.forecast_days = forecast_days
+        self.days = np.array([], dtype='datetime64[D]')
+        self.rain = np.array([], dtype=float)  # mm, observed
+        self.qpf = np.array([], dtype=float)  # mm, forecast
+        self.et0 = np.array([], dtype=float)  # mm
+        self.merged_on = None  # 'today' at the last merge, days before it are final
+
+    def __len__(self):
+        return len(self.days)
+
+    def fetch_range(self, today=None):
+        """ (start date, number of days) still needed to bring the window up to date """
+        if today is None:
+            today = date.today()
+        first = today - timedelta(days=self.history_days)
+        if len(self.days) and self.merged_on is not None:
+            # Days stored before the last merge's today are final, that day itself may have had more rain since
+            first = max(first, min(today, self.merged_on))
+        last = today + timedelta(days=self.forecast_days - 1)
+        return first, (last - first).days + 1
+
+    def merge(self, mixer_data, today=None):
+        """ Fold an api/4/mixer response into the window and drop days that fell out of it """
+        if today is None:
+            today = date.today()
+        records = mixer_data.get('mixerDataByDate') or []
+        if not records:
+            return
+
+        days = np.array([r['day'][:10] for r in records], dtype='datetime64[D]')
+        rain = np.array([_value(r, 'rain') for r in records])
+        qpf = np.array([_value(r, 'qpf') for r in records])
+        et0 = np.array([_value(r, 'et0final', 'et0') for r in records])
+
+        self.merged_on = today
+        keep = self.days < days.min()  # newly fetched days replace stored ones
+        self.days = np.concatenate((self.days[keep], days))
+        self.rain = np.concatenate((self.rain[keep], rain))
+        self.qpf = np.concatenate((self.qpf[keep], qpf))
+        self.et0 = np.concatenate((self.et0[keep], et0))
+
+        order = np.argsort(self.days, kind='stable')
+        first = np.datetime64(today - timedelta(days=self.history_days))
+        in_window = self.days[order] >= first
+        order = order[in_window]
+        self.days, self.rain, self.qpf, self.et0 = self.days[order], self.rain[order], self.qpf[order], self.et0[order]
+
+    def as_mixer_data(self, start, days):
+        """ The stored records from start on, in the shape of an api/4/mixer response """
+        mask = self.days >= np.datetime64(start)
+        idx = np.flatnonzero(mask)[:days]
+        return {'mixerDataByDate': [
+            {'day': str(self.days[i]), 'rain': None if np.isnan(self.rain[i]) else float(self.rain[i]),
+             'qpf': None if np.isnan(self.qpf[i]) else float(self.qpf[i]),
+             'et0final': None if np.isnan(self.et0[i]) else float(self.et0[i])}
+            for i in idx]}
+
+    def analytics(self, today=None):
+        """ Rolling rain totals, ET deficit and rain-skip likelihood, all in mm except the percentage """
+        if today is None:
+            today = date.today()
+        today = np.datetime64(today)
+        age = (today - self.days).astype(int)  # 0 today, positive in the past, negative in the forecast
+
+        past7 = (age >= 0) & (age < 7)
+        past30 = (age >= 0) & (age < 30)
+        rain7 = np.nansum(self.rain[past7])
+        rain30 = np.nansum(self.rain[past30])
+        deficit7 = np.nansum(self.et0[past7]) - rain7
+
+        # A day is likely skipped when its forecast rain covers its ET
+        ahead = (age <= 0) & (age > -SKIP_DAYS)
+        qpf, et0 = self.qpf[ahead], self.et0[ahead]
+        known = ~np.isnan(qpf) & ~np.isnan(et0)
+        skip = 100.0 * np.count_nonzero(qpf[known] >= et0[known]) / known.sum() if known.any() else 0.0
+
+        return {'rain7': float(rain7), 'rain30': float(rain30), 'deficit7': float(deficit7), 'skip': float(skip)}
+
+
+def convert(values, units):
+    """ Vectorized mm to display units, returns (values, uom) """
+    values = np.asarray(values, dtype=float)
+    if units == 'metric':
+        return np.round(values, 2), 82
+    return np.round(values / MM_PER_INCH, 2), 105
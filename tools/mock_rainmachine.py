@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Mock Rainmachine API server for load testing.
+Serves the api/4 endpoints the nodeserver uses over HTTPS with a throwaway self-signed
+certificate, for any number of zones and programs. Zones take turns watering so state,
+remaining time and program status keep changing between polls.
+Each simulated device listens on its own loopback address (127.0.0.2, 127.0.0.3, ...) on
+port 8080, as the nodeserver always connects to port 8080 on hardware version 2.
+MIT License
+"""
+import json
+import os
+import re
+import ssl
+import subprocess
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PORT = 8080
+RUN_SECONDS = 20  # each zone waters this long before the next one starts
+
+
+def make_certificate(directory):
+    """ Self-signed certificate and key for the mock servers, returns (certfile, keyfile) """
+    cert = os.path.join(directory, 'mock.crt')
+    key = os.path.join(directory, 'mock.key')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-keyout', key, '-out', cert,
+                    '-days', '1', '-subj', '/CN=rainmachine.mock'],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+class MockDevice(object):
+
+    def __init__(self, zones, programs, started=None):
+        self.zones = zones
+        self.programs = programs
+        self.started = time.time() if started is None else started
+        self.requests = 0
+
+    def running_zone(self, now=None):
+        """ (uid, seconds remaining) of the zone watering now """
+        elapsed = int((time.time() if now is None else now) - self.started)
+        return elapsed // RUN_SECONDS % self.zones + 1, RUN_SECONDS - elapsed % RUN_SECONDS
+
+    def zone(self):
+        running, remaining = self.running_zone()
+        return {'zones': [
+            {'uid': uid, 'name': 'Zone {}'.format(uid), 'state': 1 if uid == running else 0,
+             'active': True, 'userDuration': 600, 'machineDuration': 600,
+             'remaining': remaining if uid == running else 0, 'cycle': 0, 'noOfCycles': 0,
+             'restriction': False, 'type': 2, 'master': False, 'waterSense': False}
+            for uid in range(1, self.zones + 1)]}
+
+    def zone_properties(self):
+        return {'zones': [
+            {'uid': uid, 'name': 'Zone {}'.format(uid), 'active': True,
+             'waterSense': {'precipitationRate': 25.4, 'area': 50.0 + uid, 'flowrate': None}}
+            for uid in range(1, self.zones + 1)]}
+
+    def program(self):
+        running, _ = self.running_zone()
+        today = date.today()
+        return {'programs': [
+            {'uid': uid, 'name': 'Program {}'.format(uid), 'active': True, 'startTime': '06:00',
+             'cycles': 0, 'soak': 0, 'cs_on': False, 'delay': 0, 'delay_on': False,
+             'status': 1 if uid == (running - 1) % self.programs + 1 else 0,
+             'frequency': {'type': uid % 3 and 2 or 0, 'param': '1010100'},
+             'nextRun': str(today + timedelta(days=uid % 3)), 'startDate': str(today - timedelta(days=30)),
+             'endDate': None, 'startTimeParams': {'offsetSign': 0, 'type': uid % 3, 'offsetMinutes': 15},
+             'wateringTimes': [{'id': z, 'name': 'Zone {}'.format(z), 'duration': 300, 'active': True}
+                               for z in range(1, self.zones + 1) if z % self.programs == uid % self.programs]}
+            for uid in range(1, self.programs + 1)]}
+
+    @staticmethod
+    def mixer(start, days):
+        start = date.fromisoformat(start)
+        return {'mixerDataByDate': [
+            {'day': str(start + timedelta(days=i)), 'rain': round(i % 5 * 0.7, 2), 'qpf': round(i % 4 * 1.1, 2),
+             'et0final': 3.2, 'minTemp': 8.0, 'maxTemp': 21.0}
+            for i in range(days)]}
+
+    def dailystats(self):
+        today = date.today()
+        return {'DailyStats': [{'day': str(today + timedelta(days=i)), 'percentage': 1.0 - i * 0.1,
+                                'wateringFlag': 0} for i in range(7)]}
+
+    def dailystats_details(self):
+        today = date.today()
+        return {'DailyStatsDetails': [
+            {'day': str(today + timedelta(days=i)),
+             'programs': [{'id': p, 'zones': [{'id': z, 'computedWateringTime': 240}
+                                              for z in range(1, self.zones + 1) if z % self.programs == p % self.programs]}
+                          for p in range(1, self.programs + 1)]}
+            for i in range(7)]}
+
+    def get(self, path):
+        if path == 'api/4/apiVer':
+            return {'apiVer': '4.6.1', 'hwVer': 3, 'swVer': '4.0.1144'}
+        if path == 'api/4/zone':
+            return self.zone()
+        if path == 'api/4/zone/properties':
+            return self.zone_properties()
+        if path == 'api/4/program':
+            return self.program()
+        if path == 'api/4/provision':
+            return {'location': {'latitude': 49.28, 'longitude': -123.12, 'timezone': 'America/Vancouver'}}
+        if path == 'api/4/restrictions/hourly':
+            return {'hourlyRestrictions': [{'uid': 1, 'dayStartMinute': 600, 'minuteDuration': 120,
+                                            'weekDays': '1111111'}]}
+        if path == 'api/4/restrictions/currently':
+            return {'hourly': False, 'freeze': False, 'month': False, 'weekDay': False, 'rainDelay': False,
+                    'rainDelayCounter': -1, 'rainSensor': False}
+        if path == 'api/4/dailystats':
+            return self.dailystats()
+        if path == 'api/4/dailystats/details':
+            return self.dailystats_details()
+        match = re.match(r'api/4/mixer/(\d{4}-\d{2}-\d{2})/(\d+)$', path)
+        if match:
+            return self.mixer(match.group(1), int(match.group(2)))
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    device = None
+
+    def _path(self):
+        return self.path.split('?')[0].strip('/')
+
+    def do_GET(self):
+        self.device.requests += 1
+        body = self.device.get(self._path())
+        self._reply(404 if body is None else 200, body or {'statusCode': 404})
+
+    def do_POST(self):
+        self.device.requests += 1
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        if self._path() == 'api/4/auth/login':
+            self._reply(200, {'access_token': 'mock-token', 'expires_in': 157679999, 'statusCode': 0})
+        else:
+            self._reply(200, {'statusCode': 0, 'message': 'OK'})
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def serve(devices, zones, programs, certfile, keyfile, ready=None, stop=None):
+    """ Run 'devices' mock Rainmachines until stop (a multiprocessing Event) is set """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    servers = []
+    for n in range(devices):
+        handler = type('Handler', (_Handler,), {'device': MockDevice(zones, programs)})
+        server = ThreadingHTTPServer((device_host(n), PORT), handler)
+        server.daemon_threads = True
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    if ready is not None:
+        ready.set()
+    try:
+        while stop is None or not stop.is_set():
+            time.sleep(0.2)
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+def device_host(n):
+    return '127.0.0.{}'.format(n + 2)
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Scale harness for the Rainmachine nodeserver.
+Runs the real controller against mock Rainmachines (tools/mock_rainmachine.py) with a stub
+polyinterface (tools/stub_polyinterface.py) for every combination of zone, program and device
+counts given, with the poll intervals sped up, and reports discovery time, poll cycle and
+command latency percentiles, CPU, RSS and thread counts for each.
+
+    python3 tools/scale_harness.py --zones 8,32,96 --programs 4,16 --devices 1,4 --duration 60
+
+Each scale point runs in a fresh process so memory and threads from one don't leak into the
+next. The shipped request budget is used with only its rate multiplied by the speedup, so
+drops and deferrals show up as they would in the field; --request-rate and --request-burst
+override it. All devices of a point run in one process and share that budget, as rmfuncs
+keeps one per process. After the steady state each device is restarted on the same stub
+Polyglot to time a rediscovery of nodes Polyglot already has. The mock servers run in their
+own process and aren't counted.
+MIT License
+"""
+import argparse
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TOOLS_DIR)
+
+SHORT_POLL = 30  # seconds, Polyglot's default shortPoll
+LONG_POLL = 60
+COMMAND_INTERVAL = 5  # seconds (sped up) between simulated zone commands from ISY
+SAMPLE_INTERVAL = 0.25  # seconds between RSS and thread count samples
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def rss_bytes():
+    """ Current resident set size, peak if /proc isn't available """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Sampler(object):
+    """ Peak RSS and thread count on a background thread """
+
+    def __init__(self):
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='harness-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            self.peak_rss = max(self.peak_rss, rss_bytes())
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            if self._stop.wait(SAMPLE_INTERVAL):
+                return
+
+
+def timed(cycle, durations):
+    """ Wrap a poll cycle so each run's duration is recorded """
+    def timed_cycle():
+        started = time.monotonic()
+        try:
+            return cycle()
+        finally:
+            durations.append(time.monotonic() - started)
+    timed_cycle.__name__ = getattr(cycle, '__name__', 'cycle')
+    return timed_cycle
+
+
+def run_point(zones, programs, devices, args, results):
+    """ One scale point, run in its own process """
+    # start() rewrites profile/version.txt and profile.zip in the working directory, keep that out of the repo
+    workdir = tempfile.mkdtemp(prefix='rm-scale-')
+    shutil.copy(os.path.join(REPO_DIR, 'server.json'), workdir)
+    shutil.copytree(os.path.join(REPO_DIR, 'profile'), os.path.join(workdir, 'profile'))
+    os.chdir(workdir)
+    sys.path[:0] = [REPO_DIR, TOOLS_DIR]
+    import stub_polyinterface
+    stub_polyinterface.install()
+    logging.basicConfig(filename='harness.log', level=logging.WARNING)
+
+    import rainmachine
+    from mock_rainmachine import device_host
+    from rm_functions import budget
+    from rm_functions import rmfuncs as rm
+    from rm_functions.pollsched import PollGuard
+    from rm_functions.tiers import TIERS
+
+    speedup = args.speedup
+    # Through the custom params like a user would set them, the shipped budget unless overridden
+    limits = {'RequestRate': (args.request_rate or budget.DEFAULT_RATE) * speedup}
+    if args.request_burst:
+        limits['RequestBurst'] = args.request_burst
+
+    baseline_rss = rss_bytes()
+    baseline_threads = threading.active_count()
+    sampler = Sampler()
+    sampler.start()
+
+    cycle_durations = []
+
+    def start_controller(poly):
+        ctl = rainmachine.RMController(poly)
+        ctl.poll = PollGuard('poll', ctl.poller.submit, timed(ctl.profiler.wrap(ctl._poll_cycle), cycle_durations),
+                             ctl.poll_overrun)
+        ctl.start()
+        ctl.tiers.configure({endpoint: default / speedup for endpoint, default in TIERS.values()})
+        return ctl
+
+    polys = []
+    for n in range(devices):
+        poly = stub_polyinterface.Interface('Rainmachine')
+        poly.config['customParams'].update({'Hostname': device_host(n), 'Password': 'mock', 'Units': 'metric'})
+        poly.config['customParams'].update(limits)
+        poly.config['customData']['Loglevel'] = args.loglevel
+        polys.append(poly)
+    controllers = [start_controller(poly) for poly in polys]
+
+    cpu_start = cpu_seconds()
+    started = time.monotonic()
+    futures = [ctl.discover() for ctl in controllers]
+    discovery = []
+    for future in futures:
+        future.result(timeout=args.timeout)
+        discovery.append(time.monotonic() - started)
+    failed = [ctl.host for ctl in controllers if not ctl.discovery_done]
+    discovery_rss = rss_bytes()
+
+    # Steady state: Polyglot's shortPoll and longPoll timers plus the odd zone command, sped up
+    command_latency = []
+    cpu_steady = cpu_seconds()
+    updates_before = sum(poly.status_updates for poly in polys)
+    steady_started = time.monotonic()
+    deadline = steady_started + args.duration
+    next_short = next_long = next_command = steady_started
+    while time.monotonic() < deadline:
+        now = time.monotonic()
+        if now >= next_short:
+            for ctl in controllers:
+                ctl.shortPoll()
+            next_short += SHORT_POLL / speedup
+        if now >= next_long:
+            for ctl in controllers:
+                ctl.longPoll()
+            next_long += LONG_POLL / speedup
+        if now >= next_command:
+            for ctl in controllers:
+                if not ctl.rmzonenode:
+                    continue
+                zone = ctl.rmzonenode[int(now) % len(ctl.rmzonenode)]
+                command = {'address': zone.address, 'cmd': 'RUN', 'value': 1}
+                # What RmZone.zone_run queues, timed from ISY's command to the device's reply
+                sent = time.monotonic()
+                ctl.loop.submit(rm.RmZoneCtrl, zone.url, zone.token, command, priority=budget.COMMAND) \
+                    .add_done_callback(lambda f, sent=sent: command_latency.append(time.monotonic() - sent))
+            next_command += COMMAND_INTERVAL / speedup
+        time.sleep(max(0.0, min(next_short, next_long, next_command) - time.monotonic()))
+
+    # Let the last cycles finish so they're counted
+    for ctl in controllers:
+        ctl.poller.call(lambda: None)
+        ctl.loop.call(lambda: None)
+    steady = time.monotonic() - steady_started
+    cpu_used = cpu_seconds() - cpu_steady
+    updates = sum(poly.status_updates for poly in polys) - updates_before
+    nodes = sum(len(ctl.nodes) for ctl in controllers)
+    overruns = sum(ctl.poll.overruns for ctl in controllers)
+    dropped = rm.BUDGET.dropped
+
+    # Restart every device on the Polyglot that already has its nodes
+    for ctl in controllers:
+        ctl.stop()
+    adds_before = sum(poly.node_adds for poly in polys)
+    controllers = [start_controller(poly) for poly in polys]
+    started = time.monotonic()
+    for future in [ctl.discover() for ctl in controllers]:
+        future.result(timeout=args.timeout)
+    restart = time.monotonic() - started
+    readds = sum(poly.node_adds for poly in polys) - adds_before
+    sampler.stop()
+
+    results.put({
+        'zones': zones,
+        'programs': programs,
+        'devices': devices,
+        'nodes': nodes,
+        'failed': failed,
+        'discovery_s': max(discovery) if discovery else None,
+        'discovery_cpu_s': cpu_steady - cpu_start,
+        'cycles': len(cycle_durations),
+        'cycle_p50_ms': _ms(percentile(cycle_durations, 50)),
+        'cycle_p95_ms': _ms(percentile(cycle_durations, 95)),
+        'cycle_p99_ms': _ms(percentile(cycle_durations, 99)),
+        'commands': len(command_latency),
+        'command_p50_ms': _ms(percentile(command_latency, 50)),
+        'command_p95_ms': _ms(percentile(command_latency, 95)),
+        'command_p99_ms': _ms(percentile(command_latency, 99)),
+        'overruns': overruns,
+        'dropped': dropped,
+        'updates_per_s': updates / steady,
+        'restart_s': restart,
+        'readds': readds,
+        'cpu_pct': 100.0 * cpu_used / steady,
+        'rss_mb': _mb(rss_bytes()),
+        'rss_growth_mb': _mb(rss_bytes() - discovery_rss),
+        'rss_over_baseline_mb': _mb(sampler.peak_rss - baseline_rss),
+        'threads': sampler.peak_threads,
+        'threads_over_baseline': sampler.peak_threads - baseline_threads,
+    })
+
+    for ctl in controllers:
+        ctl.stop()
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def _mb(value):
+    return round(value / 1048576.0, 1)
+
+
+COLUMNS = [
+    ('zones', 'zones'), ('programs', 'progs'), ('devices', 'devs'), ('nodes', 'nodes'),
+    ('discovery_s', 'disc s'), ('cycles', 'cycles'), ('cycle_p50_ms', 'cyc p50'), ('cycle_p95_ms', 'cyc p95'),
+    ('cycle_p99_ms', 'cyc p99'), ('command_p50_ms', 'cmd p50'), ('command_p99_ms', 'cmd p99'),
+    ('overruns', 'ovr'), ('dropped', 'drop'), ('updates_per_s', 'upd/s'), ('restart_s', 'rst s'),
+    ('readds', 're-add'), ('cpu_pct', 'cpu %'), ('rss_mb', 'rss MB'),
+    ('rss_growth_mb', 'rss +MB'), ('threads', 'thr'),
+]
+
+
+def print_table(rows):
+    def cell(value):
+        if value is None:
+            return '-'
+        if isinstance(value, float):
+            return '{:.1f}'.format(value)
+        return str(value)
+
+    table = [[title for _, title in COLUMNS]] + [[cell(row.get(key)) for key, _ in COLUMNS] for row in rows]
+    widths = [max(len(r[i]) for r in table) for i in range(len(COLUMNS))]
+    for r in table:
+        print('  '.join(c.rjust(w) for c, w in zip(r, widths)))
+    for row in rows:
+        if row.get('failed'):
+            print("{zones} zones/{programs} programs/{devices} devices: discovery failed for {failed}".format(**row))
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Rainmachine nodeserver against mock devices")
+    parser.add_argument('--zones', type=int_list, default=[8, 32, 96], help="comma separated zone counts")
+    parser.add_argument('--programs', type=int_list, default=[4], help="comma separated program counts")
+    parser.add_argument('--devices', type=int_list, default=[1, 4], help="comma separated device counts")
+    parser.add_argument('--duration', type=float, default=30, help="seconds of polling per scale point")
+    parser.add_argument('--speedup', type=float, default=10, help="how much faster than real time to poll")
+    parser.add_argument('--request-rate', type=float, help="RequestRate before the speedup, default the shipped rate")
+    parser.add_argument('--request-burst', type=float, help="RequestBurst, default the shipped burst")
+    parser.add_argument('--loglevel', type=int, default=30, help="nodeserver log level, written to harness.log")
+    parser.add_argument('--timeout', type=float, default=300, help="seconds to wait for discovery")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, TOOLS_DIR)
+    import mock_rainmachine
+
+    ctx = multiprocessing.get_context('spawn')
+    certdir = tempfile.mkdtemp(prefix='rm-mock-')
+    certfile, keyfile = mock_rainmachine.make_certificate(certdir)
+
+    rows = []
+    for zones, programs, devices in itertools.product(args.zones, args.programs, args.devices):
+        print("Running {} zones, {} programs, {} devices...".format(zones, programs, devices), file=sys.stderr)
+        ready, stop = ctx.Event(), ctx.Event()
+        server = ctx.Process(target=mock_rainmachine.serve,
+                             args=(devices, zones, programs, certfile, keyfile, ready, stop), daemon=True)
+        server.start()
+        if not ready.wait(30):
+            server.terminate()
+            sys.exit("Mock Rainmachine didn't start")
+
+        results = ctx.Queue()
+        worker = ctx.Process(target=run_point, args=(zones, programs, devices, args, results))
+        worker.start()
+        try:
+            rows.append(results.get(timeout=args.timeout + args.duration + 60))
+        except Exception:
+            print("Scale point {}/{}/{} didn't report".format(zones, programs, devices), file=sys.stderr)
+        worker.join(30)
+        if worker.is_alive():
+            worker.terminate()
+        stop.set()
+        server.join(10)
+
+    print_table(rows)
+    if args.json:
+        with open(args.json, 'w') as outfile:
+            json.dump(rows, outfile, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Minimal stand-in for polyinterface, enough to run the Rainmachine controller without
+Polyglot or MQTT. Node adds are acknowledged after ADD_DELAY seconds from a timer thread,
+like Polyglot's replies arriving on the MQTT thread, and drivers are reported the way
+polyinterface 2.1 reports them. Used by tools/scale_harness.py.
+MIT License
+"""
+import copy
+import logging
+import sys
+import threading
+
+LOGGER = logging.getLogger('polyinterface')
+
+ADD_DELAY = 0.02  # seconds before Polyglot "confirms" a node add
+
+
+class Interface(object):
+    """
+    Keeps what Polyglot would: the nodes added and the last value ISY was sent for each driver,
+    so a new Controller on the same Interface starts like a nodeserver restart.
+    """
+
+    def __init__(self, name, config=None):
+        self.name = name
+        self.config = config or {'customParams': {}, 'customData': {}, 'nodes': [], 'notices': {}}
+        self._on_config = []
+        self.stored = {}  # address -> {'address', 'name', 'drivers': [{'driver', 'value', 'uom'}, ...]}
+        self.node_adds = 0
+        self.status_updates = 0
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def onConfig(self, callback):
+        self._on_config.append(callback)
+
+    def push_config(self, config):
+        self.config = config
+        for callback in self._on_config:
+            callback(config)
+
+    def installprofile(self):
+        return True
+
+    def saveCustomData(self, data):
+        self.config['customData'] = dict(data)
+
+    def addNode(self, node):
+        self.node_adds += 1
+
+    def send(self, message):
+        status = message.get('status')
+        if status is None:
+            return
+        self.status_updates += 1
+        stored = self.stored.get(status['address'])
+        if stored is not None:
+            for d in stored['drivers']:
+                if d['driver'] == status['driver']:
+                    d['value'], d['uom'] = status['value'], status['uom']
+
+
+class Node(object):
+    """ Driver handling as in polyinterface 2.1: changes are detected against _drivers, the last values reported """
+    drivers = []
+    commands = {}
+
+    def __init__(self, controller, primary, address, name):
+        self.controller = controller
+        self.parent = controller
+        self.primary = primary
+        self.address = address
+        self.name = name
+        self.poly = controller.poly if controller is not None else None
+        self.drivers = copy.deepcopy(self.drivers)
+        self._drivers = copy.deepcopy(self.drivers)
+
+    def setDriver(self, driver, value, report=True, force=False, uom=None):
+        for d in self.drivers:
+            if d['driver'] == driver:
+                d['value'] = value
+                if uom is not None:
+                    d['uom'] = uom
+                if report:
+                    self.reportDriver(d, report, force)
+                break
+
+    def reportDriver(self, driver, report, force):
+        for d in self._drivers:
+            if d['driver'] == driver['driver'] and \
+                    (str(d['value']) != str(driver['value']) or d['uom'] != driver['uom'] or force):
+                d['value'] = copy.deepcopy(driver['value'])
+                d['uom'] = copy.deepcopy(driver['uom'])
+                self.controller.poly.send({'status': {'address': self.address, 'driver': d['driver'],
+                                                      'value': str(d['value']), 'uom': d['uom']}})
+                break
+
+    def getDriver(self, driver):
+        for d in self.drivers:
+            if d['driver'] == driver:
+                return d['value']
+        return None
+
+    def reportDrivers(self):
+        self._drivers = copy.deepcopy(self.drivers)
+        for d in self.drivers:
+            self.controller.poly.send({'status': {'address': self.address, 'driver': d['driver'],
+                                                  'value': str(d['value']), 'uom': d['uom']}})
+
+    def start(self):
+        pass
+
+    def runCmd(self, command):
+        fun = self.commands.get(command['cmd'])
+        if fun is not None:
+            return fun(self, command)
+
+
+class Controller(Node):
+
+    def __init__(self, poly):
+        self.poly = poly
+        self.polyConfig = poly.config
+        self.nodes = {}
+        self._nodes = poly.stored  # Polyglot's copy of the nodes, survives a restart
+        self.nodesAdding = []
+        self._lock = threading.Lock()
+        self.notices = {}
+        super(Controller, self).__init__(None, None, 'controller', 'Controller')
+        self.controller = self.parent = self
+        self.poly = poly
+
+    def addNode(self, node, update=False):
+        known = self._nodes.get(node.address)
+        if known is not None:
+            node._drivers = known['drivers']
+            for driver in node.drivers:
+                for existing in known['drivers']:
+                    if driver['driver'] == existing['driver']:
+                        driver['value'] = existing['value']
+        with self._lock:
+            self.nodes[node.address] = node
+            self.nodesAdding.append(node.address)
+        self.poly.addNode(node)
+        timer = threading.Timer(ADD_DELAY, self._added, args=(node,))
+        timer.daemon = True
+        timer.start()
+        return node
+
+    def _added(self, node):
+        with self._lock:
+            if node.address in self.nodesAdding:
+                self.nodesAdding.remove(node.address)
+            self._nodes[node.address] = {'address': node.address, 'name': node.name,
+                                         'drivers': copy.deepcopy(node._drivers)}
+        node.start()
+
+    def addCustomParam(self, params):
+        self.polyConfig['customParams'].update(params)
+
+    def addNotice(self, data, key=None):
+        self.notices[key or len(self.notices)] = data
+
+    def removeNotice(self, key):
+        self.notices.pop(key, None)
+
+    def removeNoticesAll(self):
+        self.notices.clear()
+
+
+def install():
+    """ Make 'import polyinterface' load this stub """
+    sys.modules['polyinterface'] = sys.modules[__name__]